@@ -1,87 +1,104 @@
+import os
 from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import path, reverse
+from django.core.paginator import Paginator
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import format_html
-from django.http import HttpResponse
-from .models import TelegramUser, Product, Order, WithdrawalRequest, CartItem, ProductImage
-import openpyxl
-from openpyxl.styles import Font
-from openpyxl.utils import get_column_letter
-
-# --- УМНЫЙ ЭКСПОРТ В EXCEL ---
-def export_to_excel(modeladmin, request, queryset):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Export Data"
-
-    if queryset.model == Order:
-        headers = [
-            'ID', 'Пользователь', 'Артикул', 'Товар', 'Цена WB', '% Кэшбэка', 
-            'Статус', 'Дата', 'Реквизиты', 'Скрин Заказа', 'Скрин Чека', 'Номер чека'
-        ]
-    elif queryset.model == WithdrawalRequest:
-        headers = ['ID', 'Пользователь', 'Сумма', 'Реквизиты', 'Статус', 'Дата']
-    else:
-        headers = [field.name for field in modeladmin.model._meta.fields]
-
-    ws.append(headers)
-    
-    for cell in ws[1]: 
-        cell.font = Font(bold=True)
-
-    for obj in queryset:
-        row = []
-        
-        if queryset.model == Order:
-            u_name = str(obj.user) if obj.user else "Нет"
-            details = obj.user.payment_details if obj.user and obj.user.payment_details else "Нет реквизитов"
-            
-            p_art = obj.product.article if obj.product else "-"
-            p_name = obj.product.name if obj.product else "-"
-            p_price = obj.product.wb_price if obj.product else 0
-            p_perc = obj.product.cashback_percent if obj.product else 0
-            
-            s1 = obj.screenshot.url if obj.screenshot else "-"
-            s2 = obj.receipt_screenshot.url if obj.receipt_screenshot else "-"
-            
-            check_num = obj.check_number if obj.check_number else "-"
-            
-            date_str = obj.created_at.strftime("%d.%m.%Y %H:%M")
-            
-            row = [
-                obj.id, u_name, p_art, p_name, p_price, f"{p_perc}%", 
-                obj.get_status_display(), date_str, details, s1, s2, check_num
-            ]
-        
-        elif queryset.model == WithdrawalRequest:
-            row = [
-                obj.id, str(obj.user), obj.amount, obj.phone_number, 
-                obj.get_status_display(), obj.created_at.strftime("%d.%m.%Y %H:%M")
-            ]
-        
-        else:
-            for field in headers:
-                val = getattr(obj, field, "-")
-                row.append(str(val))
-        
-        ws.append(row)
-        
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value) or "") for cell in column_cells)
-        ws.column_dimensions[get_column_letter(column_cells[0].column)].width = length + 2
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename={queryset.model._meta.model_name}_report.xlsx'
-    wb.save(response)
-    return response
-
-export_to_excel.short_description = "Скачать Excel отчет (.xlsx)"
+from django.db import connection, transaction
+from django.db.models import Exists, Max, Min, OuterRef, Subquery
+from .models import TelegramUser, Product, Order, ArchivedOrder, DuplicateOrder, WithdrawalRequest, CartItem, ProductImage, Outbox, BalanceEntry, ExportJob, ImageHash, Broadcast, order_cashback_expr
+from .cache import bump_catalog_version
+from .order_state import invalidate_users
+from .ledger import post_entries
+from .archive import restore_orders
+from .broadcast import start_broadcasts
+from .search import fts_filter, ORDER_FTS, PRODUCT_FTS
+from .utils import export_to_excel, export_to_excel_background, export_to_csv_background
+
+KEYSET_PARAM = 'before'
+# Похожие скрины уже найдены при сохранении (core/phash.py), в списке только подзапрос по order_id
+DUP_SCREENS = ImageHash.objects.filter(order=OuterRef('pk'), duplicate_of__isnull=False).order_by('distance')
+
+class EstimatedCountPaginator(Paginator):
+    """Точный счет до COUNT_LIMIT строк (COUNT по подзапросу с LIMIT), дальше — оценка без прохода по таблице."""
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        qs = self.object_list.order_by()
+        exact = qs[:self.COUNT_LIMIT + 1].count()
+        if exact <= self.COUNT_LIMIT: return exact
+        return max(self.estimate(qs), exact)
+
+    def estimate(self, qs):
+        if connection.vendor == 'postgresql':
+            # Оценка планировщика по статистике таблицы
+            sql, params = qs.values('pk').query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+        # Остальные БД: доля совпадений среди самых новых id, растянутая на весь диапазон id
+        edge = qs.order_by('-pk').values_list('pk', flat=True)[self.COUNT_LIMIT - 1]
+        bounds = qs.model._default_manager.aggregate(lo=Min('pk'), hi=Max('pk'))
+        return self.COUNT_LIMIT * (bounds['hi'] - bounds['lo'] + 1) // (bounds['hi'] - edge + 1)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        page = super().page(number)
+        bottom, size = (number - 1) * self.per_page, len(page.object_list)
+        if size < self.per_page and self.count > bottom + size:
+            # Оценка перелетела: неполная страница — последняя, считаем точно и ужимаем число страниц
+            self.__dict__['count'] = bottom + size if size else self.object_list.order_by()[:bottom].count()
+            self.__dict__.pop('num_pages', None)
+            if not size: return self.page(self.num_pages)  # ссылка вела за конец — отдаем последнюю страницу
+        return page
+
+class EstimatedCountChangeList(ChangeList):
+    """Счетчик и ссылки на страницы берутся у пагинатора уже после того, как он уточнил оценку."""
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_count = self.paginator.count
+        self.multi_page = self.result_count > self.list_per_page
+        self.page_num = min(self.page_num, self.paginator.num_pages)
+
+class OrderChangeList(EstimatedCountChangeList):
+    """Keyset-пагинация (?before=<id заказа>) и колонки-подзапросы только для страницы списка."""
+
+    def get_filters_params(self, params=None):
+        # Курсор не фильтр админки, но остается в self.params — и в ссылках пагинации/фильтров
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(KEYSET_PARAM, None)
+        return lookup_params
+
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        cursor = self.params.get(KEYSET_PARAM, '')
+        before = Order.objects.filter(pk=cursor).only('pk', 'created_at').first() if cursor.isdigit() else None
+        if before: qs = self.older_than(qs, before)
+        if request.method == 'GET':
+            # Действия (POST) получают queryset без лишних подзапросов
+            qs = qs.annotate(cashback_sum=order_cashback_expr(), dup_screen_of=Subquery(DUP_SCREENS.values('duplicate_of')[:1]))
+        return qs
+
+    @staticmethod
+    def older_than(qs, order):
+        # Заказы "старше" курсора: created_at <= ts, кроме тех же ts с id >= курсора
+        return qs.filter(created_at__lte=order.created_at).exclude(created_at=order.created_at, pk__gte=order.pk)
 
 @admin.action(description="📦 В АРХИВ (Скрыть)")
 def move_to_archive(modeladmin, request, queryset):
     queryset.update(is_archived=True)
+    if queryset.model == Product: bump_catalog_version()
 
 @admin.action(description="♻️ ВОССТАНОВИТЬ из архива")
 def restore_from_archive(modeladmin, request, queryset):
     queryset.update(is_archived=False)
+    if queryset.model == Product: bump_catalog_version()
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
@@ -95,20 +112,43 @@ class ProductAdmin(admin.ModelAdmin):
     actions = [move_to_archive, restore_from_archive]
     inlines = [ProductImageInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        found = fts_filter(queryset, PRODUCT_FTS, search_term, columns=('name', 'article'))
+        if found is None: return super().get_search_results(request, queryset, search_term)
+        return found, False
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         if 'is_archived__exact' not in request.GET:
             return qs.filter(is_archived=False)
         return qs
 
+class DuplicateScreenFilter(admin.SimpleListFilter):
+    title = "Повторные скрины"
+    parameter_name = 'dup_screen'
+
+    def lookups(self, request, model_admin):
+        return [('yes', "Есть похожий скрин"), ('no', "Нет")]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes': return queryset.filter(Exists(DUP_SCREENS))
+        if self.value() == 'no': return queryset.filter(~Exists(DUP_SCREENS))
+        return queryset
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'product_info', 'status', 'calc_cashback', 'check_number', 'created_at', 'view_screens')
-    list_filter = ('status', 'is_archived', 'created_at')
+    list_display = ('id', 'user', 'product_info', 'status', 'calc_cashback', 'check_number', 'created_at', 'view_screens', 'dup_screen')
+    list_filter = ('status', 'is_archived', DuplicateScreenFilter)
+    date_hierarchy = 'created_at'
     search_fields = ('user__username', 'user__telegram_id', 'product__article', 'check_number')
     list_select_related = ('user', 'product')
+    ordering = ('-created_at',)  # совпадает с индексами order_hot_*
+    # Полный COUNT(*) на большой таблице не считаем
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
-    actions = ['set_received', 'set_approved', 'set_rejected', move_to_archive, restore_from_archive, export_to_excel]
+    actions = ['set_received', 'set_approved', 'set_rejected', move_to_archive, restore_from_archive, export_to_excel,
+               export_to_excel_background, export_to_csv_background]
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
@@ -116,15 +156,39 @@ class OrderAdmin(admin.ModelAdmin):
             return qs.filter(is_archived=False)
         return qs
 
+    def get_changelist(self, request, **kwargs):
+        return OrderChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        # Ссылка "дальше" по курсору — для порядка по умолчанию (новые сверху), фильтры сохраняются
+        cl = getattr(response, 'context_data', {}).get('cl')
+        if cl is not None and ORDER_VAR not in cl.params and len(cl.result_list) >= cl.list_per_page:
+            last = cl.result_list[len(cl.result_list) - 1]
+            if cl.older_than(cl.queryset, last).exists():
+                response.context_data['keyset_next'] = cl.get_query_string({KEYSET_PARAM: last.pk}, [PAGE_VAR])
+        return response
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        # Заказ мог уехать в холодный архив (archive_orders) — id там тот же
+        if object_id.isdigit() and not Order.objects.filter(pk=object_id).exists() \
+                and ArchivedOrder.objects.filter(pk=object_id).exists():
+            return redirect('admin:core_archivedorder_change', object_id)
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по FTS-индексу вместо LIKE '%...%' по четырем колонкам с джойнами
+        found = fts_filter(queryset, ORDER_FTS, search_term)
+        if found is None: return super().get_search_results(request, queryset, search_term)
+        return found, False
+
     @admin.display(description="Товар")
     def product_info(self, obj):
         return f"{obj.product.name} (Арт: {obj.product.article})"
 
-    @admin.display(description="К выплате")
+    @admin.display(description="К выплате", ordering=order_cashback_expr())
     def calc_cashback(self, obj):
-        if not obj.product: return "0 ₽"
-        amount = int(obj.product.wb_price * obj.product.cashback_percent / 100)
-        return f"{amount} ₽"
+        return f"{int(obj.cashback_sum or 0)} ₽"
 
     @admin.display(description="Скриншоты")
     def view_screens(self, obj):
@@ -135,31 +199,222 @@ class OrderAdmin(admin.ModelAdmin):
             html += format_html('<br><a href="{}" target="_blank">🧾 Чек</a>', obj.receipt_screenshot.url)
         return format_html(html) if html else "-"
 
+    @admin.display(description="Похож на", ordering=Exists(DUP_SCREENS))
+    def dup_screen(self, obj):
+        if not obj.dup_screen_of: return "-"
+        url = reverse('admin:core_order_change', args=[obj.dup_screen_of])
+        return format_html('<a href="{}" style="color:#c00;">⚠️ #{}</a>', url, obj.dup_screen_of)
+
     @admin.action(description="Статус -> ✅ Получен")
     def set_received(self, request, queryset):
+        users = list(queryset.values_list('user_id', flat=True))
         queryset.update(status='received')
+        invalidate_users(users)
 
     @admin.action(description="Статус -> ❌ Отклонено")
     def set_rejected(self, request, queryset):
+        users = list(queryset.values_list('user_id', flat=True))
         queryset.update(status='rejected')
+        invalidate_users(users)
 
     @admin.action(description="Статус -> 💰 Выплачено")
     def set_approved(self, request, queryset):
-        count = 0
-        for order in queryset:
-            if order.status != 'approved':
-                order.status = 'approved'
-                cash = (order.product.wb_price * order.product.cashback_percent) / 100
-                order.user.balance += cash
-                order.user.save()
-                order.save()
-                count += 1
-        self.message_user(request, f"Выплачено заказов: {count}")
+        # Кэшбэк считается в SQL, проводки пишутся пачкой, баланс меняется через F().
+        # Заказы блокируются, чтобы два одновременных клика не выплатили дважды.
+        with transaction.atomic():
+            pending = queryset.exclude(status='approved').order_by()
+            paid = BalanceEntry.objects.filter(kind='cashback', order=OuterRef('pk'))
+            rows = list(
+                pending.select_for_update(of=('self',))
+                .annotate(cash=order_cashback_expr(), paid=Exists(paid))
+                .values_list('pk', 'user_id', 'cash', 'paid')
+            )
+            if rows:
+                # Заказ, за который кэшбэк уже начисляли (вернули из "Выплачено"), второй раз не платим
+                post_entries([
+                    BalanceEntry(user_id=user_id, order_id=pk, kind='cashback', amount=cash)
+                    for pk, user_id, cash, paid in rows if not paid
+                ])
+                pending.update(status='approved')
+        invalidate_users(user_id for _, user_id, _, _ in rows)
+        self.message_user(request, f"Выплачено заказов: {len(rows)}")
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    # Холодный архив: только просмотр и выгрузка, менять статусы можно после возврата
+    list_display = ('id', 'user', 'product_info', 'status', 'calc_cashback', 'check_number', 'created_at', 'moved_at')
+    list_filter = ('status',)
+    date_hierarchy = 'created_at'
+    search_fields = ('=id', 'user__telegram_id', 'product__article', 'check_number')
+    list_select_related = ('user', 'product')
+    ordering = ('-created_at',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['restore_to_hot', export_to_excel, export_to_excel_background, export_to_csv_background]
+
+    product_info = OrderAdmin.product_info
+    calc_cashback = OrderAdmin.calc_cashback
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(cashback_sum=order_cashback_expr())
+
+    def has_add_permission(self, request): return False
+    def has_change_permission(self, request, obj=None): return False
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+    @admin.action(description="↩️ Вернуть в рабочую таблицу")
+    def restore_to_hot(self, request, queryset):
+        self.message_user(request, f"Возвращено заказов: {restore_orders(queryset)}")
+
+@admin.register(DuplicateOrder)
+class DuplicateOrderAdmin(admin.ModelAdmin):
+    # Дубли, снятые миграцией 0010: только просмотр, баланс и оставленный заказ оператор правит сам
+    list_display = ('id', 'kept_order', 'user', 'product', 'status', 'check_number', 'created_at', 'moved_at')
+    list_filter = ('status',)
+    search_fields = ('=id', '=kept_order_id', 'user__telegram_id', 'product__article')
+    list_select_related = ('user', 'product')
+
+    @admin.display(description="Оставленный заказ", ordering='kept_order_id')
+    def kept_order(self, obj):
+        url = reverse('admin:core_order_change', args=[obj.kept_order_id])
+        return format_html('<a href="{}">#{}</a>', url, obj.kept_order_id)
+
+    def has_add_permission(self, request): return False
+    def has_change_permission(self, request, obj=None): return False
 
 @admin.register(WithdrawalRequest)
 class WithdrawalAdmin(admin.ModelAdmin):
     list_display = ('user', 'amount', 'phone_number', 'status')
-    actions = [export_to_excel]
+    readonly_fields = ('status',)  # статус меняется только действиями, чтобы не разойтись с журналом
+    actions = ['set_paid', 'set_rejected', export_to_excel, export_to_excel_background, export_to_csv_background]
+
+    @admin.action(description="Статус -> 💸 Выплачено (списать с баланса)")
+    def set_paid(self, request, queryset):
+        with transaction.atomic():
+            pending = queryset.filter(status='pending').order_by()
+            rows = list(pending.select_for_update().values_list('pk', 'user_id', 'amount'))
+            if rows:
+                post_entries([
+                    BalanceEntry(user_id=user_id, withdrawal_id=pk, kind='withdrawal', amount=-amount)
+                    for pk, user_id, amount in rows
+                ])
+                pending.update(status='paid')
+        self.message_user(request, f"Выплачено заявок: {len(rows)}")
+
+    @admin.action(description="Статус -> ❌ Отклонено")
+    def set_rejected(self, request, queryset):
+        queryset.filter(status='pending').update(status='rejected')
+
+@admin.register(BalanceEntry)
+class BalanceEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'amount', 'order_id', 'withdrawal', 'comment', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('user__telegram_id', 'user__username', 'comment')
+    list_select_related = ('user', 'withdrawal')
+    raw_id_fields = ('user',)
+    fields = ('user', 'amount', 'comment')
+
+    # Журнал только дописывается: вручную можно добавить лишь корректировку
+    def has_change_permission(self, request, obj=None): return False
+    def has_delete_permission(self, request, obj=None): return False
+
+    def save_model(self, request, obj, form, change):
+        obj.kind = 'adjustment'
+        post_entries([obj])
+
+@admin.register(TelegramUser)
+class TelegramUserAdmin(admin.ModelAdmin):
+    list_display = ('telegram_id', 'username', 'balance', 'payment_details')
+    search_fields = ('telegram_id', 'username')
+    readonly_fields = ('balance',)  # меняется только через журнал баланса
+
+@admin.register(Outbox)
+class OutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chat_id', 'status', 'attempts', 'created_at', 'sent_at', 'last_error')
+    list_filter = ('status',)
+    search_fields = ('chat_id',)
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'model', 'format', 'status', 'progress', 'created_by', 'created_at', 'finished_at', 'download')
+    list_filter = ('status', 'format')
+    readonly_fields = ('model', 'selection', 'format', 'status', 'total_rows', 'rows_done', 'file', 'error', 'created_by',
+                       'started_at', 'heartbeat_at', 'attempts', 'finished_at')
+
+    def has_add_permission(self, request): return False
+
+    @admin.display(description="Прогресс")
+    def progress(self, obj):
+        if obj.status == 'done': return f"{obj.rows_done} строк"
+        if obj.total_rows: return f"{obj.rows_done} / {obj.total_rows}"
+        return "-"
+
+    @admin.display(description="Файл")
+    def download(self, obj):
+        if obj.status == 'done' and obj.file:
+            url = reverse('admin:core_exportjob_download', args=[obj.pk])
+            return format_html('<a href="{}">⬇️ Скачать</a>', url)
+        return obj.error[:100] if obj.status == 'failed' else "-"
+
+    # В выгрузках есть реквизиты, поэтому файл отдается через админку, а не по MEDIA_URL
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view), name='core_exportjob_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        job = get_object_or_404(ExportJob, pk=pk, status='done')
+        if not self.has_view_permission(request, job) or not job.file: raise Http404
+        return FileResponse(job.file.open('rb'), as_attachment=True, filename=os.path.basename(job.file.name))
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('id', 'short_text', 'status', 'paid', 'progress', 'delivered', 'blocked', 'failed', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'total', 'delivered', 'blocked', 'failed', 'created_by', 'started_at', 'finished_at')
+    fieldsets = [
+        (None, {
+            'fields': ('text', 'parse_mode', 'paid'),
+            'description': "Обычная рассылка идет в общем лимите бота (~25 сообщений/с: 100 тыс. юзеров — больше часа) "
+                           "и пропускает вперед уведомления о заказах. Уложиться в минуты можно только с «платной» "
+                           "(allow_paid_broadcast, до 1000/с, оплачивается звездами Telegram).",
+        }),
+        ("Ход рассылки", {'fields': readonly_fields}),
+    ]
+    actions = ['launch', 'pause', 'cancel']
+
+    # Текст меняется только у черновика; отправляет воркер в процессе бота (core/broadcast.py)
+    def get_readonly_fields(self, request, obj=None):
+        if obj and obj.status != 'draft': return ('text', 'parse_mode', 'paid') + self.readonly_fields
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        if not change: obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+
+    @admin.display(description="Текст")
+    def short_text(self, obj):
+        return obj.text[:60]
+
+    @admin.display(description="Прогресс")
+    def progress(self, obj):
+        if not obj.total: return "-"
+        done = obj.delivered + obj.blocked + obj.failed
+        return f"{done} / {obj.total} ({done * 100 // obj.total}%)"
+
+    @admin.action(description="📣 Запустить / продолжить")
+    def launch(self, request, queryset):
+        self.message_user(request, f"Запущено рассылок: {start_broadcasts(queryset)}")
+
+    @admin.action(description="⏸ Пауза")
+    def pause(self, request, queryset):
+        self.message_user(request, f"На паузе: {queryset.filter(status='running').update(status='paused')}")
+
+    @admin.action(description="⛔ Отменить")
+    def cancel(self, request, queryset):
+        updated = queryset.filter(status__in=('draft', 'running', 'paused')).update(status='cancelled', finished_at=timezone.now())
+        self.message_user(request, f"Отменено: {updated}")
 
-admin.site.register(TelegramUser)
 admin.site.register(CartItem)
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'core'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from django.db.backends.signals import connection_created
+        from .metrics import install_db_wrapper
+        connection_created.connect(install_db_wrapper)
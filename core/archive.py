@@ -0,0 +1,53 @@
+from django.db import transaction
+from .models import Order, ArchivedOrder
+from .order_state import invalidate_users
+
+# --- ХОЛОДНЫЙ АРХИВ ЗАКАЗОВ ---
+# Старые завершенные заказы переносятся из core_order в core_archivedorder с тем же id,
+# чтобы рабочая таблица (бот, WebApp, список в админке) оставалась маленькой.
+FINAL_STATUSES = ('approved', 'rejected')
+ORDER_FIELDS = ('id', 'user_id', 'product_id', 'status', 'screenshot', 'receipt_screenshot',
+                'check_number', 'created_at', 'is_archived')
+BATCH_SIZE = 500
+
+
+def _move(src_model, dst_model, ids):
+    rows = list(src_model.objects.filter(pk__in=ids).values(*ORDER_FIELDS))
+    objs = [dst_model(**row) for row in rows]
+    dst_model.objects.bulk_create(objs, ignore_conflicts=True)
+    if dst_model is Order:
+        # auto_now_add у Order.created_at затирает дату при вставке — возвращаем исходную
+        for obj, row in zip(objs, rows): obj.created_at = row['created_at']
+        Order.objects.bulk_update(objs, ['created_at'], batch_size=BATCH_SIZE)
+    # Удаляем только то, что реально легло в dst: при возврате из архива
+    # строку может отбросить уникальный индекс (user, product)
+    done = list(dst_model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    # Одним DELETE, без выборки строк и post_delete на каждую (ссылки на заказы — DO_NOTHING).
+    # Версии состояния бота move_in_batches поднимает сразу для всех юзеров пачек.
+    gone = src_model.objects.filter(pk__in=done)
+    gone._raw_delete(gone.db)
+    return done
+
+
+def move_in_batches(queryset, dst_model, batch_size=BATCH_SIZE):
+    """Переносит строки queryset в dst_model пачками, каждая пачка — своя транзакция."""
+    moved, last, users = 0, 0, set()
+    while True:
+        with transaction.atomic():
+            # Курсор по pk: отброшенные строки остаются в источнике и повторно не читаются
+            ids = list(queryset.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids: break
+            done = _move(queryset.model, dst_model, ids)
+            moved += len(done)
+            users.update(dst_model.objects.filter(pk__in=done).values_list('user_id', flat=True))
+        last = ids[-1]
+    invalidate_users(users)
+    return moved
+
+
+def archive_orders(queryset, batch_size=BATCH_SIZE):
+    return move_in_batches(queryset, ArchivedOrder, batch_size)
+
+
+def restore_orders(queryset, batch_size=BATCH_SIZE):
+    return move_in_batches(queryset, Order, batch_size)
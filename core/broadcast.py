@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from .models import Broadcast, TelegramUser
+from .outbox import RateLimiter, backoff
+from .db_executor import bot_db
+
+logger = logging.getLogger(__name__)
+
+# --- РАССЫЛКИ ---
+# Воркер в процессе бота идет по TelegramUser страницами по pk. Страница сначала "забирается"
+# (курсор last_user_pk сдвигается в БД), потом отправляется, потом пишутся счетчики.
+# После рестарта рассылка продолжается с курсора, повторов нет. При штатной остановке курсор
+# откатывается на последнего начатого получателя; если процесс убит посреди страницы,
+# ее остаток пропускается (лучше недослать, чем прислать дважды) и виден как total минус счетчики.
+# Обычная рассылка идет в общем лимите бота (~25/с, 100 тыс. юзеров — больше часа) и уступает
+# уведомлениям о заказах; уложиться в минуты можно только платной (allow_paid_broadcast, до 1000/с).
+PAGE_SIZE = 500
+MAX_TRIES = 3
+IDLE_SLEEP = 2.0
+PAID_RATE = 1000  # лимит Telegram для allow_paid_broadcast
+PAID_CONCURRENCY = 200
+
+
+def start_broadcasts(queryset):
+    """Запуск/продолжение из админки. Получателей считаем один раз, при первом запуске."""
+    now = timezone.now()
+    started = 0
+    for b in queryset.filter(status__in=('draft', 'paused')):
+        if b.status == 'draft':
+            b.total = TelegramUser.objects.count()
+            b.started_at = now
+        b.status = 'running'
+        b.save(update_fields=['status', 'total', 'started_at'])
+        started += 1
+    return started
+
+
+async def deliver(bot, limiter, broadcast, chat_id, stopping):
+    """Отправка одному юзеру. Возвращает 'delivered' | 'blocked' | 'failed'."""
+    for attempt in range(1, MAX_TRIES + 1):
+        await limiter.wait(chat_id, background=True)
+        try:
+            await bot.send_message(chat_id, broadcast.text, parse_mode=broadcast.parse_mode or None,
+                                   allow_paid_broadcast=broadcast.paid or None)
+            return 'delivered'
+        except TelegramRetryAfter as e:
+            # Флуд-лимит: тормозим всю отправку и повторяем этому же чату после паузы
+            limiter.pause(e.retry_after)
+            if stopping.is_set(): return 'failed'
+            await asyncio.sleep(e.retry_after)
+        except TelegramForbiddenError:
+            return 'blocked'
+        except TelegramBadRequest:
+            return 'failed'  # чат удален / не найден — повтор не поможет
+        except Exception as e:
+            logger.warning("Broadcast #%s -> %s: %s", broadcast.id, chat_id, e)
+            if stopping.is_set(): return 'failed'
+            if attempt < MAX_TRIES: await asyncio.sleep(backoff(attempt))
+    return 'failed'
+
+
+def _claim_page(broadcast_id):
+    """Сдвигает курсор на конец следующей страницы. Возвращает (рассылка, [(pk, chat_id)]) или None, если ее остановили."""
+    with transaction.atomic():
+        b = Broadcast.objects.select_for_update().filter(pk=broadcast_id, status='running').first()
+        if b is None: return None
+        page = list(TelegramUser.objects.filter(pk__gt=b.last_user_pk).order_by('pk').values_list('pk', 'telegram_id')[:PAGE_SIZE])
+        if not page:
+            Broadcast.objects.filter(pk=b.pk).update(status='done', finished_at=timezone.now())
+            return b, []
+        Broadcast.objects.filter(pk=b.pk).update(last_user_pk=page[-1][0])
+    return b, page
+
+
+def _save_page(broadcast_id, results, cursor=None):
+    fields = {kind: F(kind) + results.count(kind) for kind in ('delivered', 'blocked', 'failed')}
+    if cursor is not None: fields['last_user_pk'] = cursor
+    Broadcast.objects.filter(pk=broadcast_id).update(**fields)
+
+
+async def send_page(bot, limiter, broadcast, page, concurrency):
+    """Отправляет страницу. При отмене (рестарт бота) новые отправки не начинаются,
+    начатые дожидаются, а курсор откатывается на последнего, кому реально начали слать."""
+    slots = asyncio.Semaphore(concurrency)
+    stopping = asyncio.Event()
+    started = []
+
+    async def one(pk, chat_id):
+        async with slots:
+            # Слоты выдаются по очереди, поэтому начатые отправки — всегда начало страницы
+            if stopping.is_set(): return None
+            started.append(pk)
+            return await deliver(bot, limiter, broadcast, chat_id, stopping)
+
+    tasks = [asyncio.ensure_future(one(pk, chat_id)) for pk, chat_id in page]
+    try:
+        results = await asyncio.shield(asyncio.gather(*tasks))
+    except asyncio.CancelledError:
+        stopping.set()
+        results = await asyncio.gather(*tasks)
+        cursor = max(started) if started else page[0][0] - 1
+        await bot_db.run(_save_page, broadcast.pk, results, cursor)
+        raise
+    await bot_db.run(_save_page, broadcast.pk, results)
+
+
+async def run_broadcast(bot, limiter, broadcast_id):
+    paid_limiter = None
+    while True:
+        claimed = await bot_db.run(_claim_page, broadcast_id)
+        if claimed is None: return  # пауза или отмена из админки
+        broadcast, page = claimed
+        if not page: return
+
+        if broadcast.paid:
+            paid_limiter = paid_limiter or RateLimiter(rate=PAID_RATE, per_chat=0)
+            await send_page(bot, paid_limiter, broadcast, page, PAID_CONCURRENCY)
+        else:
+            # Запросов в полете столько, сколько лимитер пропускает за секунду
+            await send_page(bot, limiter, broadcast, page, max(1, int(1 / limiter.interval)))
+
+
+async def run_broadcast_worker(bot, limiter):
+    while True:
+        try:
+            broadcast_id = await bot_db.run(
+                lambda: Broadcast.objects.filter(status='running').order_by('id').values_list('pk', flat=True).first())
+            if broadcast_id:
+                await run_broadcast(bot, limiter, broadcast_id)
+                continue
+        except Exception:
+            logger.exception("Broadcast worker error")
+        await asyncio.sleep(IDLE_SLEEP)
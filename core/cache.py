@@ -0,0 +1,37 @@
+import time
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from .models import Product
+
+# --- КЭШ КАТАЛОГА ---
+# Версия каталога меняется при любом изменении товаров/фото (см. signals.py).
+# Карточки хранятся под ключом с версией, поэтому старые данные просто
+# перестают читаться и вытесняются по таймауту.
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_CARDS_TIMEOUT = 60 * 60 * 24
+
+
+def get_catalog_version():
+    return cache.get_or_set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_catalog_cards():
+    """Список карточек [(product_id, html, html_выкуплено)] для текущей версии."""
+    key = f'catalog:cards:{get_catalog_version()}'
+    cards = cache.get(key)
+    if cards is None:
+        products = Product.objects.filter(active=True).prefetch_related('images')
+        cards = [
+            (
+                p.id,
+                render_to_string('core/product_card.html', {'product': p, 'bought': False}),
+                render_to_string('core/product_card.html', {'product': p, 'bought': True}),
+            )
+            for p in products
+        ]
+        cache.set(key, cards, CATALOG_CARDS_TIMEOUT)
+    return cards
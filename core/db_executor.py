@@ -0,0 +1,67 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+# --- ПУЛ ПОТОКОВ ДЛЯ БД БОТА ---
+# Async-ORM Django (aget, aupdate...) гоняет все запросы через один поток
+# sync_to_async(thread_sensitive=True), и параллельные апдейты бота встают в очередь к нему.
+# Здесь свой пул: у каждого потока свое соединение (Django хранит их per-thread),
+# оно переиспользуется между вызовами, закрывается после ошибки, если стало негодным, и на выходе.
+# workers=0 — старое поведение через sync_to_async (для сравнения в bench_bot_db).
+DEFAULT_WORKERS = int(os.getenv('BOT_DB_THREADS', 8))
+
+
+class DBExecutor:
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.pool = None
+        self.workers = 0
+        self.configure(workers)
+
+    def configure(self, workers):
+        self.shutdown()
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='bot-db') if workers else None
+
+    async def run(self, func, *args, **kwargs):
+        call = functools.partial(func, *args, **kwargs)
+        if self.pool is None:
+            return await sync_to_async(call)()
+        # Контекст копируется, как в sync_to_async: иначе метрики (ContextVar) не увидят запросы
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.pool, ctx.run, _call_with_connection, call)
+
+    def shutdown(self):
+        if self.pool is None: return
+        # Каждому потоку — по задаче закрыть свои соединения; барьер не дает одному потоку забрать две
+        size = len(self.pool._threads)
+        if size:
+            barrier = threading.Barrier(size)
+            for _ in range(size): self.pool.submit(_close_thread_connections, barrier)
+        self.pool.shutdown(wait=True)
+        self.pool = None
+
+
+def _call_with_connection(call):
+    try:
+        return call()
+    finally:
+        # close_old_connections() тут не подходит: при CONN_MAX_AGE=0 он рвет соединение
+        # после каждого вызова. Закрываем только то, что сломалось (как делает Django в запросах)
+        for conn in connections.all(initialized_only=True):
+            if conn.connection is not None and conn.errors_occurred:
+                if conn.is_usable(): conn.errors_occurred = False
+                else: conn.close()
+
+
+def _close_thread_connections(barrier):
+    connections.close_all()
+    try: barrier.wait(timeout=5)
+    except threading.BrokenBarrierError: pass
+
+
+bot_db = DBExecutor()
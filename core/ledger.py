@@ -0,0 +1,33 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Case, When, Value, DecimalField
+from .models import BalanceEntry, TelegramUser
+
+# --- ЖУРНАЛ БАЛАНСА ---
+# Любое изменение TelegramUser.balance идет только через post_entries: проводки
+# пишутся пачкой, а balance сдвигается на их сумму в той же транзакции.
+# Проверка сходимости: manage.py reconcile_balances
+BATCH_SIZE = 400
+
+
+def post_entries(entries):
+    entries = [e for e in entries if e.amount]
+    if not entries: return 0
+
+    totals = defaultdict(Decimal)
+    for e in entries:
+        totals[e.user_id] += e.amount
+    items = [(user_id, total) for user_id, total in totals.items() if total]
+
+    with transaction.atomic():
+        BalanceEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+        # Один UPDATE на пачку юзеров: balance = balance + CASE id WHEN ... END
+        for i in range(0, len(items), BATCH_SIZE):
+            chunk = items[i:i + BATCH_SIZE]
+            delta = Case(
+                *[When(pk=user_id, then=Value(total)) for user_id, total in chunk],
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+            TelegramUser.objects.filter(pk__in=[user_id for user_id, _ in chunk]).update(balance=F('balance') + delta)
+    return len(entries)
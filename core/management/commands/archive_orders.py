@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from core.models import Order
+from core.archive import archive_orders, FINAL_STATUSES, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Move old finished or archived orders into the cold ArchivedOrder table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Переносить заказы старше N дней')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        queryset = Order.objects.filter(created_at__lt=cutoff).filter(
+            Q(status__in=FINAL_STATUSES) | Q(is_archived=True)
+        )
+        if options['dry_run']:
+            self.stdout.write(f"К переносу: {queryset.count()}")
+            return
+        moved = archive_orders(queryset, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Перенесено в архив: {moved}"))
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.http import JsonResponse
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings
+from django.urls import include, path
+from django.views.decorators.csrf import csrf_exempt
+from core.models import TelegramUser, Product, CartItem, Outbox
+from core.thumbnails import thumb_url
+from core.views import _create_orders
+
+BENCH_ARTICLE = 'BENCH-'
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values: return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# --- СИНХРОННЫЕ ВЕРСИИ API (как до перевода на async) ---
+# Сторона "wsgi" гоняет именно их: так видно, что дал переход на async views,
+# а не как новые async views работают через WSGI-обработчик.
+
+def sync_get_cart_api(request):
+    user_id = request.GET.get('user_id')
+    if not user_id: return JsonResponse({'cart': []})
+    try:
+        user = TelegramUser.objects.get(telegram_id=user_id)
+        cart_data = []
+        for item in user.cart_items.select_related('product').all():
+            p = item.product
+            cart_data.append({'id': str(p.id), 'name': p.name, 'price': str(p.price), 'img': thumb_url(p.image, 320)})
+        return JsonResponse({'cart': cart_data, 'payment_details': user.payment_details or ""})
+    except: return JsonResponse({'cart': []})
+
+@csrf_exempt
+def sync_update_cart_api(request):
+    data = json.loads(request.body)
+    user, _ = TelegramUser.objects.get_or_create(telegram_id=data['user_id'])
+    product = Product.objects.get(id=data['product_id'])
+    if data.get('action') == 'add': CartItem.objects.get_or_create(user=user, product=product)
+    else: CartItem.objects.filter(user=user, product=product).delete()
+    return JsonResponse({'ok': True})
+
+@csrf_exempt
+def sync_save_payment_details_api(request):
+    data = json.loads(request.body)
+    try:
+        user = TelegramUser.objects.get(telegram_id=data.get('user_id'))
+        user.payment_details = data.get('details')
+        user.save()
+        return JsonResponse({'ok': True})
+    except: return JsonResponse({'ok': False})
+
+@csrf_exempt
+def sync_create_order_api(request):
+    data = json.loads(request.body)
+    p_ids = [pid for pid in data.get('products', '').split(',') if pid]
+    result, status = _create_orders(data.get('user_id'), p_ids)
+    return JsonResponse(result, status=status)
+
+urlpatterns = [
+    path('api/get-cart/', sync_get_cart_api),
+    path('api/update-cart/', sync_update_cart_api),
+    path('api/save-details/', sync_save_payment_details_api),
+    path('api/create-order/', sync_create_order_api),
+    path('', include('wb_project.urls')),
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark WebApp API under concurrent load: old sync views on WSGI (threads) vs async views on ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на сценарий')
+        parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов')
+        parser.add_argument('--user-id', type=int, default=999000001, help='telegram_id тестового юзера (и следующий за ним)')
+
+    def handle(self, *args, **options):
+        self.n = options['requests']
+        self.concurrency = options['concurrency']
+        # У каждого режима свой юзер: заказ на пару (юзер, товар) создается один раз
+        users = {'wsgi': options['user_id'], 'asgi': options['user_id'] + 1}
+
+        product = Product.objects.order_by('id').first()
+        if not product:
+            self.stderr.write("Нет товаров — нечего тестировать")
+            return
+        for user_id in users.values():
+            TelegramUser.objects.get_or_create(telegram_id=user_id, defaults={'username': 'bench'})
+
+        try:
+            # Товары под заказы: скрытые, чтобы не попасть в каталог WebApp
+            Product.objects.bulk_create([
+                Product(name=f"Bench {i}", article=f"{BENCH_ARTICLE}{i}", price=1, wb_price=1, active=False, is_archived=True)
+                for i in range(self.n)
+            ], batch_size=500)
+            order_products = list(Product.objects.filter(article__startswith=BENCH_ARTICLE).order_by('id').values_list('id', flat=True))
+
+            def cart_body(i, user_id):
+                action = 'add' if i % 2 == 0 else 'remove'
+                return json.dumps({'user_id': user_id, 'product_id': product.id, 'action': action})
+
+            scenarios = [
+                ('get_cart', 'get', lambda user_id: f'/api/get-cart/?user_id={user_id}', None),
+                ('update_cart', 'post', lambda user_id: '/api/update-cart/', cart_body),
+                ('save_details', 'post', lambda user_id: '/api/save-details/',
+                 lambda i, user_id: json.dumps({'user_id': user_id, 'details': f'bench {i}'})),
+                ('create_order', 'post', lambda user_id: '/api/create-order/',
+                 lambda i, user_id: json.dumps({'user_id': user_id, 'products': str(order_products[i])})),
+            ]
+
+            failed = []
+            self.stdout.write(f"{'сценарий':<14}{'режим':<7}{'rps':>9}{'p50, мс':>10}{'p99, мс':>10}{'ошибок':>8}")
+            # Оба тестовых клиента ходят с Host: testserver (AsyncClient не дает его заменить)
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for name, method, url, body in scenarios:
+                    for mode, runner in (('wsgi', self.run_wsgi), ('asgi', self.run_asgi)):
+                        user_id = users[mode]
+                        elapsed, latencies, codes = runner(method, url(user_id), body and (lambda i: body(i, user_id)))
+                        errors = [code for code in codes if code >= 400]
+                        line = (f"{name:<14}{mode:<7}{self.n / elapsed:>9.1f}"
+                                f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 99) * 1000:>10.1f}{len(errors):>8}")
+                        if errors:
+                            # Время ответов с ошибкой — не то, что мы меряем
+                            failed.append(f"{name}/{mode}")
+                            line = self.style.ERROR(f"{line}   коды: {', '.join(map(str, sorted(set(errors))))}")
+                        self.stdout.write(line)
+            if failed:
+                raise CommandError(f"Ошибки в {', '.join(failed)} — цифры этих строк недействительны")
+        finally:
+            bench_users = TelegramUser.objects.filter(telegram_id__in=users.values(), username='bench')
+            CartItem.objects.filter(user__in=bench_users).delete()
+            Outbox.objects.filter(chat_id__in=users.values()).delete()
+            bench_users.delete()
+            Product.objects.filter(article__startswith=BENCH_ARTICLE).delete()
+
+    def run_wsgi(self, method, url, body):
+        def one(i):
+            client = Client(raise_request_exception=False)
+            start = time.perf_counter()
+            if method == 'get': r = client.get(url)
+            else: r = client.post(url, body(i), content_type='application/json')
+            return time.perf_counter() - start, r.status_code
+
+        def worker(i):
+            try: return one(i)
+            finally: connections.close_all()
+
+        start = time.perf_counter()
+        with override_settings(ROOT_URLCONF=__name__), ThreadPoolExecutor(self.concurrency) as pool:
+            results = list(pool.map(worker, range(self.n)))
+        elapsed = time.perf_counter() - start
+        return elapsed, [r[0] for r in results], [r[1] for r in results]
+
+    def run_asgi(self, method, url, body):
+        async def main():
+            client = AsyncClient(raise_request_exception=False)
+            sem = asyncio.Semaphore(self.concurrency)
+
+            async def one(i):
+                async with sem:
+                    start = time.perf_counter()
+                    if method == 'get': r = await client.get(url)
+                    else: r = await client.post(url, body(i), content_type='application/json')
+                    return time.perf_counter() - start, r.status_code
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(one(i) for i in range(self.n)))
+            return time.perf_counter() - start, results
+
+        elapsed, results = asyncio.run(main())
+        return elapsed, [r[0] for r in results], [r[1] for r in results]
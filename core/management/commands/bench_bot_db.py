@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+from aiogram import Bot, Dispatcher, types
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+from core.db_executor import bot_db, DEFAULT_WORKERS
+from core.management.commands import runbot
+from core.management.commands.bench_api import percentile
+from core.management.commands.loadtest import (
+    Command as LoadTestCommand, FakeTelegramSession, noise_photo, FAKE_TOKEN, PHOTO_VARIANTS, USERNAME_PREFIX,
+)
+
+
+class NetworkLatency:
+    """execute_wrapper с задержкой на каждый запрос: SQLite локальный, а Postgres в проде — по сети."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)  # sleep отпускает GIL, как ожидание ответа от сервера БД
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers: connection.execute_wrappers.append(self)
+
+
+class Command(LoadTestCommand):
+    help = 'Benchmark bot handlers with many concurrent chats: sync_to_async thread vs a DB thread pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Чатов (у каждого заказы во всех статусах)')
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--threads', default=f'0,2,{DEFAULT_WORKERS}',
+                            help='Размеры пула через запятую, 0 — общий поток sync_to_async')
+        parser.add_argument('--concurrency', default='1,10,50', help='Одновременных чатов через запятую')
+        parser.add_argument('--db-latency-ms', type=float, default=0,
+                            help='Добавить задержку на каждый SQL-запрос (имитация сетевой БД)')
+        parser.add_argument('--id-base', type=int, default=990000000)
+        parser.add_argument('--output', help='Записать результаты в JSON')
+        self.add_live_db_argument(parser)
+
+    def handle(self, *args, **options):
+        # Сценарий чата: /start, скрин чека, скрин заказа, номер чека — все ветки хендлеров с БД
+        options.update(gallery=0, orders_per_user=6, keep=False)
+        self.options = options
+        self.id_base = options['id_base']
+        threads = [int(x) for x in options['threads'].split(',')]
+        levels = [int(x) for x in options['concurrency'].split(',')]
+
+        latency = NetworkLatency(options['db_latency_ms'] / 1000) if options['db_latency_ms'] else None
+        if latency:
+            connection_created.connect(latency.install)
+            for conn in connections.all(): latency.install(connection=conn)
+
+        results = []
+        self.stdout.write(f"{'потоков':>8}{'чатов':>7}{'апд/с':>10}{'p50, мс':>10}{'p95, мс':>10}{'ошибок':>8}")
+        with self.environment():
+            try:
+                for workers in threads:
+                    for level in levels:
+                        self.cleanup()
+                        self.seed()
+                        runbot.order_states.clear()
+                        bot_db.configure(workers)
+                        row = asyncio.run(self.run_chats(level))
+                        row.update(threads=workers, concurrency=level)
+                        results.append(row)
+                        self.stdout.write(f"{workers:>8}{level:>7}{row['updates_per_s']:>10.1f}"
+                                          f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['errors']:>8}")
+            finally:
+                bot_db.configure(DEFAULT_WORKERS)
+                if latency:
+                    connection_created.disconnect(latency.install)
+                    for conn in connections.all():
+                        if latency in conn.execute_wrappers: conn.execute_wrappers.remove(latency)
+                self.cleanup()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                meta = dict(self.meta(0), db_latency_ms=options['db_latency_ms'])
+                json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+
+    async def run_chats(self, level):
+        bot = Bot(token=FAKE_TOKEN, session=FakeTelegramSession([noise_photo(i) for i in range(PHOTO_VARIANTS)]))
+        dp = Dispatcher()
+        runbot.register_handlers(dp)
+        now = timezone.now()
+        sem = asyncio.Semaphore(level)
+        latencies, errors = [], 0
+
+        def update(n, tid, **payload):
+            user = types.User(id=tid, is_bot=False, first_name='Bench', username=f"{USERNAME_PREFIX}{tid - self.id_base}")
+            message = types.Message(message_id=n, date=now, chat=types.Chat(id=tid, type='private'), from_user=user, **payload)
+            return types.Update(update_id=n, message=message)
+
+        async def chat(u):
+            nonlocal errors
+            tid = self.id_base + u
+            steps = [
+                {'text': '/start'},
+                {'photo': [types.PhotoSize(file_id=f"c{u}", file_unique_id=f"c{u}", width=64, height=64)]},
+                {'photo': [types.PhotoSize(file_id=f"s{u}", file_unique_id=f"s{u}", width=64, height=64)]},
+                {'text': f"{100000 + u}"},
+            ]
+            async with sem:
+                for i, payload in enumerate(steps):
+                    start = time.perf_counter()
+                    try: await dp.feed_update(bot, update(u * 10 + i, tid, **payload))
+                    except Exception: errors += 1
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(chat(u) for u in range(self.options['users'])))
+        elapsed = time.perf_counter() - start
+        await bot.session.close()
+        return {
+            'updates': len(latencies),
+            'errors': errors,
+            'elapsed_s': round(elapsed, 3),
+            'updates_per_s': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        }
@@ -0,0 +1,63 @@
+import random
+from collections import Counter
+from heapq import merge
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from core.models import Order, ArchivedOrder, ImageHash
+from core.phash import record_order_hashes, find_similar, hamming, MAX_DISTANCE
+
+CALIBRATE_MAX = 24
+
+
+class Command(BaseCommand):
+    help = 'Compute perceptual hashes for order screenshots and flag near-duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recheck', action='store_true',
+                            help='Заново найти похожие для уже посчитанных хешей (после смены PHASH_MAX_DISTANCE)')
+        parser.add_argument('--calibrate', type=int, metavar='N', nargs='?', const=500,
+                            help='Распределение расстояния до ближайшего скрина другого заказа по N случайным хешам')
+
+    def handle(self, *args, **options):
+        if options['calibrate']: return self.calibrate(options['calibrate'])
+
+        # По возрастанию id через обе таблицы: дубль всегда указывает на более ранний заказ
+        fields = ('id', 'screenshot', 'receipt_screenshot')
+        with_files = ~Q(screenshot='') & Q(screenshot__isnull=False) | ~Q(receipt_screenshot='') & Q(receipt_screenshot__isnull=False)
+        hot = Order.objects.filter(with_files).only(*fields).order_by('id').iterator()
+        cold = ArchivedOrder.objects.filter(with_files).only(*fields).order_by('id').iterator()
+        orders = hashed = 0
+        for order in merge(hot, cold, key=lambda o: o.pk):
+            orders += 1
+            hashed += record_order_hashes(order)
+        self.stdout.write(self.style.SUCCESS(f"Заказов со скринами: {orders}, посчитано хешей: {hashed}"))
+
+        if options['recheck']:
+            changed = 0
+            for entry in ImageHash.objects.order_by('order_id').iterator():
+                similar = find_similar(int(entry.hash, 16), before_order=entry.order_id)
+                dist, dup_id = similar[0] if similar else (None, None)
+                if (dup_id, dist) != (entry.duplicate_of_id, entry.distance):
+                    ImageHash.objects.filter(pk=entry.pk).update(duplicate_of_id=dup_id, distance=dist)
+                    changed += 1
+            self.stdout.write(self.style.SUCCESS(f"Порог {MAX_DISTANCE} бит, пересчитано связей: {changed}"))
+
+    def calibrate(self, sample_size):
+        # Перебор в памяти: инструмент для разовой настройки, не для продакшен-запросов
+        rows = [(order_id, int(h, 16)) for order_id, h in ImageHash.objects.values_list('order_id', 'hash')]
+        if len(rows) < 2:
+            self.stdout.write("Мало хешей для оценки")
+            return
+        nearest = Counter()
+        for order_id, value in random.sample(rows, min(sample_size, len(rows))):
+            dist = min((hamming(value, other) for other_order, other in rows if other_order != order_id), default=None)
+            if dist is not None: nearest[min(dist, CALIBRATE_MAX)] += 1
+
+        total = sum(nearest.values())
+        self.stdout.write(f"Ближайший скрин другого заказа, {total} хешей (текущий порог {MAX_DISTANCE}):")
+        running = 0
+        for dist in range(CALIBRATE_MAX + 1):
+            running += nearest[dist]
+            label = f"{dist}+" if dist == CALIBRATE_MAX else str(dist)
+            self.stdout.write(f"{label:>4} бит {nearest[dist]:>6}  {'#' * (nearest[dist] * 50 // total):<50} {running * 100 // total:>3}%")
+        self.stdout.write("Повторы дают всплеск у малых расстояний; порог ставят в провале перед основной массой.")
@@ -0,0 +1,372 @@
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetFile, SendMessage
+from PIL import Image
+from django import get_version
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from django.utils import timezone
+from core.cache import bump_catalog_version
+from core.db_executor import bot_db
+from core.models import TelegramUser, Product, ProductImage, Order, Outbox, ImageHash
+from core.management.commands.bench_api import percentile
+from core.management.commands import runbot
+
+# --- НАГРУЗОЧНЫЙ ТЕСТ ---
+# Сидит синтетические данные (юзеры, товары с галереей, заказы во всех статусах),
+# гоняет WebApp API через ASGI и хендлеры бота через Dispatcher с фейковыми апдейтами,
+# пишет rps, p50/p95/p99 и число SQL-запросов на сценарий в JSON для сравнения релизов.
+# По умолчанию все идет в отдельную тестовую БД, во временный MEDIA_ROOT и локальный кэш:
+# рабочие юзеры не видят тестовых товаров, а бот в проде не шлет сообщения в фейковые чаты.
+USERNAME_PREFIX = 'loadtest_'
+ARTICLE_PREFIX = 'LOADTEST-'
+MEDIA_DIR = 'loadtest'
+FAKE_TOKEN = '123456:LOADTEST'
+PHOTO_VARIANTS = 64
+
+
+class QueryCounter:
+    """execute_wrapper, который считает запросы на всех соединениях (и в потоках sync_to_async)."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock: self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers: connection.execute_wrappers.append(self)
+
+
+class FakeTelegramSession(BaseSession):
+    """Сессия aiogram без сети: методы бота отвечают заглушками, файлы отдаются из памяти."""
+
+    def __init__(self, photos):
+        super().__init__()
+        self.photos = photos
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if isinstance(method, GetFile):
+            return types.File(file_id=method.file_id, file_unique_id=method.file_id, file_path=f"photos/{method.file_id}.jpg")
+        if isinstance(method, SendMessage):
+            chat = types.Chat(id=method.chat_id, type='private')
+            return types.Message(message_id=self.calls, date=datetime.now(), chat=chat, text=method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        data = self.photos[hash(url) % len(self.photos)]
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    async def close(self):
+        pass
+
+
+def jpeg_bytes(img, quality=80):
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def noise_photo(seed, size=64):
+    # Случайный шум: у каждого варианта свой dHash, поиск дублей не вырождается
+    rnd = random.Random(seed)
+    return jpeg_bytes(Image.frombytes('L', (size, size), bytes(rnd.randrange(256) for _ in range(size * size))))
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic dataset and load-test the WebApp API and bot handlers, write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--gallery', type=int, default=3, help='Доп. фото на товар')
+        parser.add_argument('--orders-per-user', type=int, default=len(Order.STATUS_CHOICES),
+                            help='Заказов на юзера, статусы идут по кругу по STATUS_CHOICES')
+        parser.add_argument('--requests', type=int, default=500, help='Запросов на сценарий')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--id-base', type=int, default=990000000, help='telegram_id первого тестового юзера')
+        parser.add_argument('--only', nargs='*', help='Запустить только эти сценарии')
+        parser.add_argument('--output', default='loadtest.json', help='Куда записать отчет')
+        parser.add_argument('--compare', help='Отчет прошлого релиза для сравнения')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовые данные после прогона (только с --live-db)')
+        self.add_live_db_argument(parser)
+
+    @staticmethod
+    def add_live_db_argument(parser):
+        parser.add_argument('--live-db', action='store_true',
+                            help='Гонять на настроенной БД и MEDIA_ROOT, а не на временной копии (только при DEBUG)')
+
+    @contextmanager
+    def environment(self):
+        """Временная тестовая БД (с миграциями), MEDIA_ROOT и кэш на время прогона."""
+        if self.options['live_db']:
+            if not settings.DEBUG: raise CommandError("--live-db разрешен только при DEBUG=True")
+            yield
+            return
+
+        workdir = tempfile.mkdtemp(prefix='loadtest-')
+        test_settings = connection.settings_dict['TEST']
+        old_name, old_test_name = connection.settings_dict['NAME'], test_settings.get('NAME')
+        # SQLite в памяти плохо переносит запись из нескольких потоков — берем файл
+        if connection.vendor == 'sqlite': test_settings['NAME'] = os.path.join(workdir, 'db.sqlite3')
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'loadtest'}}
+        try:
+            with override_settings(MEDIA_ROOT=os.path.join(workdir, 'media'), CACHES=caches):
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    yield
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            test_settings['NAME'] = old_test_name
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.n = options['requests']
+        self.concurrency = options['concurrency']
+        self.id_base = options['id_base']
+
+        with self.environment():
+            self.cleanup()
+            self.counter = QueryCounter()
+            try:
+                seed_time = self.seed()
+                self.stdout.write(f"Данные: {self.scale()} за {seed_time:.1f} с")
+                connection_created.connect(self.counter.install)
+                for conn in connections.all(): self.counter.install(connection=conn)
+                # AsyncClient всегда шлет Host: testserver, заменить его заголовком запроса нельзя
+                with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                    results = asyncio.run(self.run_all())
+            finally:
+                connection_created.disconnect(self.counter.install)
+                for conn in connections.all():
+                    if self.counter in conn.execute_wrappers: conn.execute_wrappers.remove(self.counter)
+                if not (options['keep'] and options['live_db']): self.cleanup()
+                bot_db.configure(bot_db.workers)  # потоки пула держат соединения с тестовой БД
+
+        # Сценарий, где упали все запросы, меряет путь ошибки — такой отчет сравнивать нельзя
+        broken = [r['name'] for r in results if r['errors'] == r['requests']]
+        if broken:
+            self.print_table(results, {})
+            raise CommandError(f"Все запросы с ошибкой: {', '.join(broken)}. Отчет не записан")
+
+        report = {'meta': self.meta(seed_time), 'scenarios': results}
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = {s['name']: s for s in json.load(f)['scenarios']}
+        self.print_table(results, baseline)
+        self.stdout.write(self.style.SUCCESS(f"Отчет: {options['output']}"))
+
+    # --- ДАННЫЕ ---
+
+    def scale(self):
+        o = self.options
+        return {k: o[k] for k in ('users', 'products', 'gallery', 'orders_per_user')}
+
+    def seed(self):
+        start = time.perf_counter()
+        o = self.options
+        users_n, products_n = o['users'], o['products']
+        opu = min(o['orders_per_user'], products_n)
+
+        cover = default_storage.save(f"{MEDIA_DIR}/cover.jpg", ContentFile(jpeg_bytes(Image.new('RGB', (800, 800), 'white'))))
+        Product.objects.bulk_create([
+            Product(name=f"Тестовый товар {i}", article=f"{ARTICLE_PREFIX}{i}", wb_price=1000 + i, price=1000 + i,
+                    cashback_percent=random.choice((50, 100)), image=cover, description="Товар для нагрузочного теста")
+            for i in range(products_n)
+        ], batch_size=500)
+        self.product_ids = [p.id for p in Product.objects.filter(article__startswith=ARTICLE_PREFIX).order_by('id').only('id')]
+        ProductImage.objects.bulk_create([
+            ProductImage(product_id=pid, image=cover) for pid in self.product_ids for _ in range(o['gallery'])
+        ], batch_size=500)
+
+        TelegramUser.objects.bulk_create([
+            TelegramUser(telegram_id=self.id_base + i, username=f"{USERNAME_PREFIX}{i}") for i in range(users_n)
+        ], batch_size=500)
+        user_pks = dict(TelegramUser.objects.filter(telegram_id__gte=self.id_base, username__startswith=USERNAME_PREFIX)
+                        .values_list('telegram_id', 'pk'))
+        statuses = [code for code, _ in Order.STATUS_CHOICES]
+        Order.objects.bulk_create([
+            Order(user_id=user_pks[self.id_base + u], product_id=self.product_ids[(u + j) % products_n], status=statuses[j % len(statuses)])
+            for u in range(users_n) for j in range(opu)
+        ], batch_size=500)
+        self.opu = opu
+        bump_catalog_version()
+        return time.perf_counter() - start
+
+    def cleanup(self):
+        users = TelegramUser.objects.filter(telegram_id__gte=self.id_base, username__startswith=USERNAME_PREFIX)
+        user_ids = list(users.values_list('telegram_id', flat=True))
+        if user_ids:
+            # Скрины, которые сохранили хендлеры бота (proofs/, checks/), в БД только по имени
+            orders = Order.objects.filter(user__telegram_id__in=user_ids)
+            hashes = ImageHash.objects.filter(order__user__telegram_id__in=user_ids)
+            media = set(hashes.values_list('name', flat=True))
+            for screenshot, receipt in orders.values_list('screenshot', 'receipt_screenshot'): media |= {screenshot, receipt}
+            # Файлы лежат по хешу содержимого: тот же файл может быть у настоящего заказа
+            test_orders = list(orders.values_list('pk', flat=True))
+            media -= set(ImageHash.objects.filter(name__in=media).exclude(order_id__in=test_orders).values_list('name', flat=True))
+            for name in media - {'', None}:
+                if default_storage.exists(name): default_storage.delete(name)
+            # У ImageHash нет FK-ограничения в БД, каскад его не снимет
+            hashes.delete()
+            Outbox.objects.filter(chat_id__in=user_ids).delete()
+            users.delete()
+        products = Product.objects.filter(article__startswith=ARTICLE_PREFIX)
+        if products.exists(): products.delete()
+        for name in (f"{MEDIA_DIR}/cover.jpg",):
+            if default_storage.exists(name): default_storage.delete(name)
+        bump_catalog_version()
+
+    # --- СЦЕНАРИИ ---
+
+    def tid(self, i):
+        return self.id_base + i % self.options['users']
+
+    def scenarios(self):
+        users_n, products_n = self.options['users'], len(self.product_ids)
+
+        def cart_body(i):
+            action = 'add' if i // users_n % 2 == 0 else 'remove'
+            return {'user_id': self.tid(i), 'product_id': self.product_ids[i % products_n], 'action': action}
+
+        def order_body(i):
+            # Каждый запрос — новая пара (юзер, товар), пока товары не кончатся, дальше идут дубликаты
+            u, k = i % users_n, i // users_n
+            return {'user_id': self.tid(i), 'products': str(self.product_ids[(u + self.opu + k) % products_n])}
+
+        return [
+            ('webapp_catalog', 'http', ('get', lambda i: f"/webapp/?user_id={self.tid(i)}")),
+            ('get_cart_api', 'http', ('get', lambda i: f"/api/get-cart/?user_id={self.tid(i)}")),
+            ('update_cart_api', 'http', ('post', '/api/update-cart/', cart_body)),
+            ('create_order_api', 'http', ('post', '/api/create-order/', order_body)),
+            ('bot_start', 'bot', lambda i: {'text': '/start'}),
+            ('bot_photo', 'bot', lambda i: {'photo': [types.PhotoSize(file_id=f"lt{i}", file_unique_id=f"lt{i}", width=64, height=64)]}),
+            ('bot_text', 'bot', lambda i: {'text': f"{100000 + i}"}),
+        ]
+
+    async def run_all(self):
+        client = AsyncClient(raise_request_exception=False)
+        photos = [noise_photo(i) for i in range(PHOTO_VARIANTS)]
+        bot = Bot(token=FAKE_TOKEN, session=FakeTelegramSession(photos))
+        dp = Dispatcher()
+        runbot.register_handlers(dp)
+
+        results = []
+        only = self.options['only']
+        for name, kind, spec in self.scenarios():
+            if only and name not in only: continue
+            if kind == 'http': one = self.http_call(client, *spec)
+            else: one = self.bot_call(dp, bot, spec)
+            results.append(await self.measure(name, one))
+        await bot.session.close()
+        return results
+
+    def http_call(self, client, method, url, body=None):
+        async def one(i):
+            if method == 'get': r = await client.get(url(i))
+            else: r = await client.post(url, json.dumps(body(i)), content_type='application/json')
+            return r.status_code < 400
+        return one
+
+    def bot_call(self, dp, bot, payload):
+        now = timezone.now()
+
+        async def one(i):
+            tid = self.tid(i)
+            message = types.Message(
+                message_id=i, date=now, chat=types.Chat(id=tid, type='private'),
+                from_user=types.User(id=tid, is_bot=False, first_name='Load', username=f"{USERNAME_PREFIX}{tid - self.id_base}"),
+                **payload(i),
+            )
+            await dp.feed_update(bot, types.Update(update_id=i, message=message))
+            return True
+        return one
+
+    async def measure(self, name, one):
+        sem = asyncio.Semaphore(self.concurrency)
+        latencies, errors = [], 0
+
+        async def timed(i):
+            nonlocal errors
+            async with sem:
+                start = time.perf_counter()
+                try: ok = await one(i)
+                except Exception: ok = False
+                latencies.append(time.perf_counter() - start)
+                if not ok: errors += 1
+
+        queries_before = self.counter.count
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(i) for i in range(self.n)))
+        elapsed = time.perf_counter() - start
+        queries = self.counter.count - queries_before
+        return {
+            'name': name,
+            'requests': self.n,
+            'concurrency': self.concurrency,
+            'errors': errors,
+            'elapsed_s': round(elapsed, 3),
+            'rps': round(self.n / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'queries': queries,
+            'queries_per_request': round(queries / self.n, 2),
+        }
+
+    # --- ОТЧЕТ ---
+
+    def meta(self, seed_time):
+        try:
+            revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5, cwd=settings.BASE_DIR).stdout.strip()
+        except OSError:
+            revision = ''
+        return {
+            'created_at': timezone.now().isoformat(),
+            'revision': revision,
+            'django': get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'scale': self.scale(),
+            'seed_s': round(seed_time, 2),
+        }
+
+    def print_table(self, results, baseline):
+        self.stdout.write(f"{'сценарий':<18}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'SQL/зап':>9}{'ошибок':>8}")
+        for r in results:
+            line = (f"{r['name']:<18}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+                    f"{r['queries_per_request']:>9.2f}{r['errors']:>8}")
+            old = baseline.get(r['name'])
+            if old and old['rps']:
+                line += f"   rps {(r['rps'] / old['rps'] - 1) * 100:+.0f}%, p95 {old['p95_ms']:.1f} -> {r['p95_ms']:.1f}"
+            self.stdout.write(self.style.ERROR(line) if r['errors'] else line)
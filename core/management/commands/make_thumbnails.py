@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from core.models import Product, ProductImage
+from django.core.files.storage import default_storage
+from core.thumbnails import make_thumbnails, thumb_name, THUMB_WIDTHS
+from core.cache import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = 'Create WebP thumbnails for product covers and gallery photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже существующие превью')
+        parser.add_argument('--prune', action='store_true', help='Удалить превью, которым не соответствует ни одна картинка')
+
+    def handle(self, *args, **options):
+        force = options['force']
+        created = errors = 0
+        files = [p.image for p in Product.objects.exclude(image='').exclude(image=None).only('image', 'thumbs_for').iterator()]
+        files += [i.image for i in ProductImage.objects.only('image', 'thumbs_for').iterator()]
+        for f in files:
+            try:
+                created += make_thumbnails(f, force=force)
+            except (OSError, ValueError) as e:
+                errors += 1
+                self.stderr.write(f"{f.name}: {e}")
+        pruned = self.prune({thumb_name(f.name, w) for f in files for w in THUMB_WIDTHS}) if options['prune'] else 0
+        bump_catalog_version()  # карточки в кэше должны получить srcset
+        self.stdout.write(self.style.SUCCESS(f"Картинок: {len(files)}, создано превью: {created}, ошибок: {errors}, удалено лишних: {pruned}"))
+
+    def prune(self, keep):
+        pruned = 0
+        for model in (Product, ProductImage):
+            folder = model._meta.get_field('image').upload_to.rstrip('/') + '/thumbs'
+            if not default_storage.exists(folder): continue
+            for filename in default_storage.listdir(folder)[1]:
+                name = f"{folder}/{filename}"
+                if name not in keep:
+                    default_storage.delete(name)
+                    pruned += 1
+        return pruned
@@ -0,0 +1,37 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from core.models import TelegramUser
+
+CENT = Decimal('0.01')
+
+
+class Command(BaseCommand):
+    help = 'Verify TelegramUser.balance against the sum of BalanceEntry rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Записать в balance сумму по журналу')
+
+    def handle(self, *args, **options):
+        # Один агрегирующий проход: balance и сумма проводок каждого юзера
+        users = (
+            TelegramUser.objects.annotate(ledger=Sum('balance_entries__amount'))
+            .values_list('pk', 'telegram_id', 'balance', 'ledger')
+            .order_by('pk')
+        )
+        mismatches = []
+        checked = 0
+        for pk, telegram_id, balance, ledger in users.iterator(chunk_size=2000):
+            checked += 1
+            ledger = Decimal(ledger or 0).quantize(CENT)
+            if balance.quantize(CENT) != ledger:
+                mismatches.append((pk, telegram_id, balance, ledger))
+
+        for pk, telegram_id, balance, ledger in mismatches:
+            self.stdout.write(f"{telegram_id}: balance={balance}, журнал={ledger}, разница={balance - ledger}")
+            if options['fix']:
+                TelegramUser.objects.filter(pk=pk).update(balance=ledger)
+
+        if mismatches and not options['fix']:
+            raise CommandError(f"Расхождений: {len(mismatches)} из {checked}")
+        self.stdout.write(self.style.SUCCESS(f"Проверено юзеров: {checked}, исправлено: {len(mismatches) if options['fix'] else 0}"))
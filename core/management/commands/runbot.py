@@ -1,11 +1,21 @@
 from django.core.management.base import BaseCommand
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
 from aiogram.filters import Command as TelegramCommand
 from aiogram.types import WebAppInfo, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from core.models import TelegramUser, Order
+from core.outbox import run_outbox_worker, RateLimiter
+from core.broadcast import run_broadcast_worker
+from core.storage import download_photo
+from core.photo_pipeline import photo_pool, PhotoBusy, PhotoRejected, WORKERS as PHOTO_WORKERS, MAX_QUEUE as PHOTO_QUEUE
+from core.order_state import OrderStateCache
+from core.phash import record_hash
+from core.metrics import BotMetricsMiddleware, is_authorized as metrics_authorized, render as render_metrics
+from core.throttling import ThrottlingMiddleware, ALLOW_RESEND
+from core.db_executor import bot_db, DEFAULT_WORKERS
 import asyncio
 import os
-from django.conf import settings
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,13 +24,16 @@ BASE_WEBAPP_URL = "*******"
 
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
+order_states = OrderStateCache()
 
 
 async def start_handler(message: types.Message):
-    await TelegramUser.objects.aget_or_create(
+    await bot_db.run(
+        TelegramUser.objects.get_or_create,
         telegram_id=message.from_user.id, 
         defaults={'username': message.from_user.username}
     )
+    order_states.forget(message.from_user.id)
     personal_url = f"{BASE_WEBAPP_URL}?user_id={message.from_user.id}"
     
     kb = ReplyKeyboardMarkup(
@@ -32,42 +45,63 @@ async def start_handler(message: types.Message):
 async def text_handler(message: types.Message):
     if message.text.startswith('/'): return
 
-    user = await TelegramUser.objects.aget(telegram_id=message.from_user.id)
+    # Юзеры без заказа на этапе "номер чека" отсекаются по кэшу, без БД
+    state = await order_states.get(message.from_user.id)
+    pending = state.last('number_wait')
     
-    order = await Order.objects.filter(user=user, status='number_wait').select_related('product').alast()
-    
-    if order:
-        order.check_number = message.text
-        order.status = 'received' 
-        await order.asave()
+    if pending:
+        order_id, product_name = pending
+        updated = await bot_db.run(
+            Order.objects.filter(id=order_id, status='number_wait').update,
+            check_number=message.text, status='received'
+        )
+        if not updated:
+            order_states.forget(message.from_user.id)
+            return
+        state.move(order_id, product_name, 'number_wait', 'received')
+        await order_states.publish(message.from_user.id, state)
         
         await message.answer(
-            f"✅ Данные приняты! Заказ на товар <b>{order.product.name}</b> отправлен на проверку.", 
+            f"✅ Данные приняты! Заказ на товар <b>{product_name}</b> отправлен на проверку.", 
             parse_mode="HTML"
         )
 
 async def photo_handler(message: types.Message):
-    user = await TelegramUser.objects.aget(telegram_id=message.from_user.id)
+    state = await order_states.get(message.from_user.id)
     
-    order_waiting_check = await Order.objects.filter(user=user, status='check_wait').alast()
-    order_new = await Order.objects.filter(user=user, status='ordered').alast()
+    order_waiting_check = state.last('check_wait')
+    order_new = state.last('ordered')
 
     if not order_waiting_check and not order_new:
         await message.answer("⚠️ Нет активных заказов для загрузки фото.")
-        return
+        return ALLOW_RESEND
 
     file_id = message.photo[-1].file_id
-    file = await bot.get_file(file_id)
+    file = await message.bot.get_file(file_id)
+    kind = 'checks' if order_waiting_check else 'proofs'
+    try:
+        path, image_hash = await download_photo(message.bot, file.file_path, kind)
+    except PhotoBusy:
+        await message.answer("⏳ Сейчас очень много фото. Пришлите скрин еще раз через минуту.")
+        return ALLOW_RESEND
+    except PhotoRejected:
+        await message.answer("⚠️ Не удалось прочитать фото. Пришлите обычный скриншот.")
+        return ALLOW_RESEND
 
     if order_waiting_check:
-        path = f"checks/{user.telegram_id}_{order_waiting_check.id}_check.jpg"
-        full_path = os.path.join(settings.MEDIA_ROOT, path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        await bot.download_file(file.file_path, full_path)
+        order_id, product_name = order_waiting_check
         
-        order_waiting_check.receipt_screenshot = path
-        order_waiting_check.status = 'number_wait'
-        await order_waiting_check.asave()
+        updated = await bot_db.run(
+            Order.objects.filter(id=order_id, status='check_wait').update,
+            receipt_screenshot=path, status='number_wait'
+        )
+        if not updated:
+            order_states.forget(message.from_user.id)
+            await message.answer("⚠️ Нет активных заказов для загрузки фото.")
+            return ALLOW_RESEND
+        state.move(order_id, product_name, 'check_wait', 'number_wait')
+        await order_states.publish(message.from_user.id, state)
+        await bot_db.run(record_hash, order_id, 'receipt', path, image_hash)
         
         await message.answer(
             f"🧾 Чек получен!\n\nТеперь отправьте <b>НОМЕР ЗАКАЗА или ЧЕКА</b> (цифры) текстом.", 
@@ -75,14 +109,19 @@ async def photo_handler(message: types.Message):
         )
 
     elif order_new:
-        path = f"proofs/{user.telegram_id}_{order_new.id}.jpg"
-        full_path = os.path.join(settings.MEDIA_ROOT, path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        await bot.download_file(file.file_path, full_path)
+        order_id, product_name = order_new
         
-        order_new.screenshot = path
-        order_new.status = 'check_wait'
-        await order_new.asave()
+        updated = await bot_db.run(
+            Order.objects.filter(id=order_id, status='ordered').update,
+            screenshot=path, status='check_wait'
+        )
+        if not updated:
+            order_states.forget(message.from_user.id)
+            await message.answer("⚠️ Нет активных заказов для загрузки фото.")
+            return ALLOW_RESEND
+        state.move(order_id, product_name, 'ordered', 'check_wait')
+        await order_states.publish(message.from_user.id, state)
+        await bot_db.run(record_hash, order_id, 'screenshot', path, image_hash)
         
         await message.answer(
             f"📸 Скрин заказа принят! \nТеперь отправьте <b>СКРИНШОТ ЧЕКА</b>.", 
@@ -90,17 +129,137 @@ async def photo_handler(message: types.Message):
         )
 
 
+def register_handlers(dispatcher):
+    dispatcher.message.register(start_handler, TelegramCommand("start"))
+    dispatcher.message.register(text_handler, F.text)
+    dispatcher.message.register(photo_handler, F.photo)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число апдейтов, которые обрабатываются одновременно."""
+
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(self, handler, event, data):
+        async with self.semaphore:
+            return await handler(event, data)
+
+
 class Command(BaseCommand):
     help = 'Run Bot'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--webhook', action='store_true', help='Принимать апдейты через вебхук вместо polling')
+        parser.add_argument('--host', default=os.getenv('WEBHOOK_HOST', '0.0.0.0'))
+        parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', 8081)))
+        parser.add_argument('--path', default=os.getenv('WEBHOOK_PATH', '/telegram/webhook'))
+        parser.add_argument('--url', default=os.getenv('WEBHOOK_URL'),
+                            help='Публичный URL вебхука. Если задан — регистрируется в Telegram при старте')
+        parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET'),
+                            help='Секрет для заголовка X-Telegram-Bot-Api-Secret-Token')
+        parser.add_argument('--max-concurrency', type=int, default=int(os.getenv('BOT_MAX_CONCURRENCY', 50)),
+                            help='Сколько апдейтов обрабатывать одновременно')
+        parser.add_argument('--metrics-port', type=int, default=int(os.getenv('BOT_METRICS_PORT', 0)),
+                            help='Порт для /metrics бота (0 — не поднимать)')
+        parser.add_argument('--metrics-host', default=os.getenv('BOT_METRICS_HOST', '127.0.0.1'),
+                            help='Адрес для /metrics бота (по умолчанию только локально)')
+        parser.add_argument('--db-threads', type=int, default=DEFAULT_WORKERS,
+                            help='Потоков для запросов к БД (0 — общий поток sync_to_async)')
+        parser.add_argument('--photo-workers', type=int, default=PHOTO_WORKERS, help='Процессов для обработки фото')
+        parser.add_argument('--photo-queue', type=int, default=PHOTO_QUEUE,
+                            help='Сколько фото может ждать/обрабатываться одновременно')
+        parser.add_argument('--no-outbox', action='store_true',
+                            help='Не запускать воркеры уведомлений и рассылок (нужны ровно в одной реплике)')
+
+    def handle(self, *args, **options):
         if not TOKEN:
             print("ОШИБКА: Токен не найден в .env!")
             return
             
-        dp.message.register(start_handler, TelegramCommand("start"))
-        dp.message.register(text_handler, F.text)
-        dp.message.register(photo_handler, F.photo)
+        bot_db.configure(options['db_threads'])
+        photo_pool.configure(options['photo_workers'], options['photo_queue'])
+        register_handlers(dp)
+        dp.update.outer_middleware(ConcurrencyLimitMiddleware(options['max_concurrency']))
+        # Флуд отсекается раньше всего, что трогает БД и диск (в т.ч. раньше замеров)
+        dp.message.outer_middleware(ThrottlingMiddleware())
+        dp.message.outer_middleware(BotMetricsMiddleware())
+        dp.message.middleware(BotMetricsMiddleware(inner=True))
+
+        if options['metrics_port']:
+            async def on_startup_metrics():
+                await start_metrics_server(options['metrics_host'], options['metrics_port'])
+            dp.startup.register(on_startup_metrics)
+
+        if not options['no_outbox']:
+            dp.startup.register(start_outbox)
+            dp.shutdown.register(stop_outbox)
+        # shutdown-хендлеры идут по порядку регистрации: пулы закрываются последними,
+        # когда воркеры уведомлений и рассылок уже сохранили прогресс через bot_db
+        dp.shutdown.register(stop_photo_pool)
+        dp.shutdown.register(stop_db)
+
+        if options['webhook']:
+            if not options['secret']:
+                print("ОШИБКА: для вебхука нужен секрет (--secret или WEBHOOK_SECRET)!")
+                return
+            print(f"Бот запущен (webhook) на {options['host']}:{options['port']}{options['path']}")
+            web.run_app(build_webhook_app(options), host=options['host'], port=options['port'])
+        else:
+            print("Бот запущен и оптимизирован...")
+            asyncio.run(dp.start_polling(bot))
+
+
+outbox_tasks = []
+
+async def start_outbox():
+    # Воркеры уведомлений и рассылок работают в том же цикле, с тем же Bot и общим лимитом
+    limiter = RateLimiter()
+    outbox_tasks.append(asyncio.create_task(run_outbox_worker(bot, limiter)))
+    outbox_tasks.append(asyncio.create_task(run_broadcast_worker(bot, limiter)))
+
+async def stop_outbox():
+    # Отмена не мгновенная: рассылка дожидается начатых отправок и пишет курсор в БД
+    for task in outbox_tasks: task.cancel()
+    await asyncio.gather(*outbox_tasks, return_exceptions=True)
+    outbox_tasks.clear()
+
+async def stop_photo_pool():
+    await asyncio.get_running_loop().run_in_executor(None, photo_pool.shutdown)
+
+async def stop_db():
+    await asyncio.get_running_loop().run_in_executor(None, bot_db.shutdown)
+
+
+async def metrics_handler(request):
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return web.Response(status=403)
+    return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+
+async def start_metrics_server(host, port):
+    # Отдельный порт: метрики не должны торчать наружу вместе с вебхуком
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Метрики бота: http://{host}:{port}/metrics")
+
+
+def build_webhook_app(options):
+    url, secret = options['url'], options['secret']
+
+    async def on_startup():
+        if url:
+            await bot.set_webhook(
+                url, secret_token=secret,
+                max_connections=min(options['max_concurrency'], 100),
+                allowed_updates=dp.resolve_used_update_types(),
+            )
 
-        print("Бот запущен и оптимизирован...")
-        asyncio.run(dp.start_polling(bot))
+    dp.startup.register(on_startup)
+    app = web.Application()
+    # handle_in_background: Telegram сразу получает 200, апдейты обрабатываются параллельно
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True).register(app, path=options['path'])
+    setup_application(app, dp, bot=bot)
+    return app
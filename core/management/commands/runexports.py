@@ -0,0 +1,91 @@
+import os
+import secrets
+import time
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from core.models import ExportJob
+from core.utils import export_rows, selection_queryset, write_xlsx, write_csv
+
+PROGRESS_EVERY = 1000
+STALE_AFTER = timedelta(minutes=30)  # столько без отметки о прогрессе — воркер считается упавшим
+MAX_ATTEMPTS = 3
+KEEP_FILES = timedelta(days=7)
+CLEANUP_EVERY = 3600
+
+
+class Command(BaseCommand):
+    help = 'Run background export jobs queued from the admin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать очередь и выйти')
+        parser.add_argument('--interval', type=float, default=3.0, help='Пауза между проверками очереди, сек')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Воркер выгрузок запущен...")
+        cleaned_at = 0
+        while True:
+            if time.monotonic() - cleaned_at > CLEANUP_EVERY:
+                self.reclaim_stale()
+                self.expire_files()
+                cleaned_at = time.monotonic()
+            job = self.claim()
+            if job:
+                self.run(job)
+                continue
+            if options['once']: return
+            time.sleep(options['interval'])
+
+    def reclaim_stale(self):
+        # Воркер упал посреди выгрузки: задача возвращается в очередь, после MAX_ATTEMPTS — ошибка
+        stale = ExportJob.objects.filter(status='running', heartbeat_at__lt=timezone.now() - STALE_AFTER)
+        failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+            status='failed', error='Воркер несколько раз падал на этой выгрузке', finished_at=timezone.now())
+        requeued = stale.update(status='pending')
+        if failed or requeued: self.stdout.write(f"Зависшие выгрузки: в очередь {requeued}, с ошибкой {failed}")
+
+    def expire_files(self):
+        old = ExportJob.objects.filter(status='done', finished_at__lt=timezone.now() - KEEP_FILES)
+        for job in old.only('id', 'file'):
+            if job.file and default_storage.exists(job.file.name): default_storage.delete(job.file.name)
+            ExportJob.objects.filter(id=job.id).update(status='expired', file=None)
+
+    def claim(self):
+        # Условный UPDATE: если воркеров несколько, задачу возьмет только один
+        for job_id in ExportJob.objects.filter(status='pending').order_by('id').values_list('id', flat=True)[:5]:
+            now = timezone.now()
+            if ExportJob.objects.filter(id=job_id, status='pending').update(
+                    status='running', started_at=now, heartbeat_at=now, attempts=F('attempts') + 1):
+                return ExportJob.objects.select_related('created_by').get(id=job_id)
+        return None
+
+    def run(self, job):
+        # Случайный суффикс — чтобы имя файла нельзя было угадать по MEDIA_URL
+        name = f"exports/{job.model.split('.')[-1].lower()}_{job.id}_{timezone.now():%Y%m%d_%H%M}_{secrets.token_hex(8)}.{job.format}"
+        full_path = os.path.join(settings.MEDIA_ROOT, name)
+        try:
+            queryset = selection_queryset(job)
+            ExportJob.objects.filter(id=job.id).update(total_rows=queryset.count())
+
+            headers, rows = export_rows(queryset)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as f:
+                writer = write_xlsx if job.format == 'xlsx' else write_csv
+                count = writer(headers, self.track(job, rows), f)
+
+            ExportJob.objects.filter(id=job.id).update(
+                status='done', rows_done=count, file=name, finished_at=timezone.now())
+            self.stdout.write(f"Выгрузка #{job.id}: {count} строк -> {name}")
+        except Exception as e:
+            if os.path.exists(full_path): os.remove(full_path)
+            ExportJob.objects.filter(id=job.id).update(status='failed', error=str(e), finished_at=timezone.now())
+            self.stderr.write(f"Выгрузка #{job.id}: ошибка {e}")
+
+    def track(self, job, rows):
+        for i, row in enumerate(rows, 1):
+            yield row
+            if i % PROGRESS_EVERY == 0:
+                ExportJob.objects.filter(id=job.id).update(rows_done=i, heartbeat_at=timezone.now())
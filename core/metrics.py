@@ -0,0 +1,199 @@
+import hmac
+import logging
+import os
+import threading
+import time
+import traceback
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('core.slow_sql')
+
+# --- МЕТРИКИ ---
+# Гистограммы в памяти процесса в текстовом формате Prometheus (/metrics).
+# Веб и бот — разные процессы, у каждого свой /metrics: веб отдает его через urls.py,
+# бот — отдельным aiohttp-сервером (runbot --metrics-port, по умолчанию только на 127.0.0.1).
+# Доступ — по METRICS_TOKEN; без токена метрики открыты только при явном METRICS_PUBLIC=1.
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+STACK_DEPTH = 4
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.samples = {}  # labels -> [счетчики по бакетам, сумма, всего]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            sample = self.samples.get(labels)
+            if sample is None:
+                sample = self.samples[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: sample[0][i] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock: samples = [(labels, list(s[0]), s[1], s[2]) for labels, s in self.samples.items()]
+        for labels, counts, total, count in sorted(samples):
+            base = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels))
+            sep = ',' if base else ''
+            for bound, c in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {c}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{base}}} {total}')
+            lines.append(f'{self.name}_count{{{base}}} {count}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = []
+
+HTTP_SECONDS = Histogram('http_request_duration_seconds', 'Время обработки запроса', ('view', 'method', 'status'))
+HTTP_QUERIES = Histogram('http_request_db_queries', 'SQL-запросов на запрос', ('view',), QUERY_BUCKETS)
+HTTP_DB_SECONDS = Histogram('http_request_db_seconds', 'Время в БД на запрос', ('view',))
+BOT_SECONDS = Histogram('bot_handler_duration_seconds', 'Время обработки апдейта хендлером', ('handler',))
+BOT_QUERIES = Histogram('bot_handler_db_queries', 'SQL-запросов на апдейт', ('handler',), QUERY_BUCKETS)
+BOT_DB_SECONDS = Histogram('bot_handler_db_seconds', 'Время в БД на апдейт', ('handler',))
+BOT_DOWNLOAD_SECONDS = Histogram('bot_photo_download_seconds', 'Скачивание фото из Telegram', ('kind',))
+
+
+def render():
+    return '\n'.join(h.render() for h in REGISTRY) + '\n'
+
+
+def is_authorized(authorization):
+    """Проверка заголовка Authorization: Bearer <METRICS_TOKEN>."""
+    if not settings.METRICS_TOKEN: return settings.METRICS_PUBLIC
+    return hmac.compare_digest(authorization or '', f"Bearer {settings.METRICS_TOKEN}")
+
+
+# --- УЧЕТ ЗАПРОСОВ К БД ---
+# Обертка стоит на всех соединениях, а счетчик текущего запроса/апдейта лежит в ContextVar:
+# sync_to_async копирует контекст, поэтому запросы async-ORM из других потоков тоже попадают сюда.
+
+class DBStats:
+    __slots__ = ('queries', 'seconds', 'name')
+
+    def __init__(self, name=''):
+        self.queries = 0
+        self.seconds = 0.0
+        self.name = name
+
+
+current_stats = ContextVar('db_stats', default=None)
+
+
+def _slow_query_ms():
+    return getattr(settings, 'SLOW_QUERY_MS', 0)
+
+
+def _app_stack():
+    # Только кадры проекта, без Django/aiogram: видно, какая строка породила запрос
+    root = str(settings.BASE_DIR)
+    frames = [f for f in traceback.extract_stack()
+              if f.filename.startswith(root) and f.filename != __file__ and 'site-packages' not in f.filename]
+    return ' <- '.join(f"{os.path.relpath(f.filename, root)}:{f.lineno} {f.name}" for f in reversed(frames[-STACK_DEPTH:]))
+
+
+def db_wrapper(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats = current_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+        slow_ms = _slow_query_ms()
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            logger.warning("%.1f ms [%s] %s | %s", elapsed * 1000, stats.name if stats else '-', sql, _app_stack())
+
+
+def install_db_wrapper(sender=None, connection=None, **kwargs):
+    if db_wrapper not in connection.execute_wrappers: connection.execute_wrappers.append(db_wrapper)
+
+
+# --- DJANGO ---
+
+class MetricsMiddleware:
+    """Время, число SQL-запросов и время в БД для каждой вьюхи. Работает и под WSGI, и под ASGI."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response): markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, start = self._begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self._record(request, response, stats, start)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, start = self._begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self._record(request, response, stats, start)
+        return response
+
+    def _begin(self, request):
+        stats = DBStats(request.path)
+        return stats, current_stats.set(stats), time.perf_counter()
+
+    def _record(self, request, response, stats, start):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        if view == 'metrics': return
+        HTTP_SECONDS.observe(time.perf_counter() - start, view, request.method, response.status_code)
+        HTTP_QUERIES.observe(stats.queries, view)
+        HTTP_DB_SECONDS.observe(stats.seconds, view)
+
+
+# --- AIOGRAM ---
+
+class BotMetricsMiddleware:
+    """Время, SQL-запросы и время в БД на апдейт по имени хендлера.
+
+    Вешается на dp.message дважды: как outer — открывает замер, как inner (inner=True) —
+    только подписывает его именем хендлера (во внешнем слое хендлер еще не выбран)."""
+
+    def __init__(self, inner=False):
+        self.inner = inner
+
+    async def __call__(self, handler, event, data):
+        if self.inner:
+            stats = current_stats.get()
+            if stats is not None: stats.name = data['handler'].callback.__name__
+            return await handler(event, data)
+
+        stats = DBStats('unhandled')
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            current_stats.reset(token)
+            BOT_SECONDS.observe(time.perf_counter() - start, stats.name)
+            BOT_QUERIES.observe(stats.queries, stats.name)
+            BOT_DB_SECONDS.observe(stats.seconds, stats.name)
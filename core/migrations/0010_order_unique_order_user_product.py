@@ -0,0 +1,76 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+# Кто дальше по этапам, тот и остается; отклоненный уступает любому живому
+STATUS_RANK = {'approved': 5, 'received': 4, 'number_wait': 3, 'check_wait': 2, 'ordered': 1, 'rejected': 0}
+COPIED_FIELDS = ('id', 'user_id', 'product_id', 'status', 'screenshot', 'receipt_screenshot', 'check_number', 'created_at', 'is_archived')
+
+
+def move_duplicate_orders(apps, schema_editor):
+    # Дубли (user, product) от гонки в get_or_create. На паре остается самый продвинутый заказ,
+    # остальные целиком переносятся в DuplicateOrder: скрины, чеки и статусы не теряются,
+    # балансы миграция не трогает — их сверяет оператор по списку ниже.
+    Order = apps.get_model('core', 'Order')
+    DuplicateOrder = apps.get_model('core', 'DuplicateOrder')
+    pairs = list(Order.objects.values('user_id', 'product_id').annotate(n=Count('id')).filter(n__gt=1)
+                 .values_list('user_id', 'product_id'))
+    report = []
+    for user_id, product_id in pairs:
+        orders = sorted(Order.objects.filter(user_id=user_id, product_id=product_id),
+                        key=lambda o: (-STATUS_RANK.get(o.status, 0), o.id))
+        keep, extra = orders[0], orders[1:]
+        DuplicateOrder.objects.bulk_create([
+            DuplicateOrder(kept_order_id=keep.id, **{f: getattr(o, f) for f in COPIED_FIELDS}) for o in extra
+        ])
+        Order.objects.filter(pk__in=[o.pk for o in extra]).delete()
+        line = (f"  юзер {user_id}, товар {product_id}: оставлен #{keep.id} ({keep.status}), "
+                f"в DuplicateOrder: {', '.join(f'#{o.id} ({o.status})' for o in extra)}")
+        paid = sum(o.status == 'approved' for o in orders)
+        if paid > 1: line += f" — кэшбэк выплачен {paid} раза, проверьте баланс"
+        report.append(line)
+    if report:
+        print(f"\n  Пар с дублями заказов: {len(pairs)}, разберите их в админке (Дубли заказов):\n" + "\n".join(report))
+
+
+def restore_duplicate_orders(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    DuplicateOrder = apps.get_model('core', 'DuplicateOrder')
+    Order.objects.bulk_create([Order(**{f: getattr(d, f) for f in COPIED_FIELDS}) for d in DuplicateOrder.objects.all()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('kept_order_id', models.BigIntegerField(verbose_name='Оставленный заказ')),
+                ('status', models.CharField(choices=[('ordered', 'Заказан (Ждет фото)'), ('check_wait', 'Ждет чек'), ('number_wait', 'Ждет номер чека'), ('received', 'Получен (На проверке)'), ('approved', 'Выплачено (Архив)'), ('rejected', 'Отклонено')], max_length=20, verbose_name='Статус')),
+                ('screenshot', models.ImageField(blank=True, null=True, upload_to='proofs/', verbose_name='Скрин ЛК')),
+                ('receipt_screenshot', models.ImageField(blank=True, null=True, upload_to='checks/', verbose_name='Скрин Чека')),
+                ('check_number', models.CharField(blank=True, max_length=255, null=True, verbose_name='Номер с чека')),
+                ('created_at', models.DateTimeField(verbose_name='Дата')),
+                ('is_archived', models.BooleanField(default=False, verbose_name='В архиве')),
+                ('moved_at', models.DateTimeField(auto_now_add=True, verbose_name='Снят как дубль')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.product', verbose_name='Товар')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.telegramuser', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Дубль заказа',
+                'verbose_name_plural': 'Дубли заказов (разобрать вручную)',
+            },
+        ),
+        migrations.RunPython(move_duplicate_orders, restore_duplicate_orders),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_order_user_product'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_opening_entries(apps, schema_editor):
+    # Текущие балансы становятся первой проводкой, чтобы журнал сошелся с balance
+    TelegramUser = apps.get_model('core', 'TelegramUser')
+    BalanceEntry = apps.get_model('core', 'BalanceEntry')
+    BalanceEntry.objects.bulk_create(
+        [
+            BalanceEntry(user_id=pk, kind='adjustment', amount=balance, comment='Начальный остаток')
+            for pk, balance in TelegramUser.objects.exclude(balance=0).values_list('pk', 'balance')
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_order_order_user_status_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('cashback', 'Кэшбэк за заказ'), ('withdrawal', 'Вывод средств'), ('adjustment', 'Корректировка')], max_length=20, verbose_name='Тип')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Сумма (+/−)')),
+                ('comment', models.CharField(blank=True, default='', max_length=255, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.order', verbose_name='Заказ')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_entries', to='core.telegramuser', verbose_name='Пользователь')),
+                ('withdrawal', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.withdrawalrequest', verbose_name='Заявка на вывод')),
+            ],
+            options={
+                'verbose_name': 'Проводка по балансу',
+                'verbose_name_plural': 'Журнал баланса',
+                'indexes': [models.Index(fields=['user', 'created_at'], name='balance_user_date_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('kind', 'cashback')), fields=('order',), name='unique_cashback_per_order'), models.UniqueConstraint(condition=models.Q(('kind', 'withdrawal')), fields=('withdrawal',), name='unique_debit_per_withdrawal')],
+            },
+        ),
+        migrations.RunPython(create_opening_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    # --- Заказы: username, telegram_id, артикул, номер чека ---
+    """CREATE VIRTUAL TABLE core_order_fts USING fts5(
+        username, telegram_id, article, check_number, tokenize='trigram')""",
+    """INSERT INTO core_order_fts(rowid, username, telegram_id, article, check_number)
+        SELECT o.id, u.username, u.telegram_id, p.article, o.check_number
+        FROM core_order o JOIN core_telegramuser u ON u.id = o.user_id JOIN core_product p ON p.id = o.product_id""",
+    """CREATE TRIGGER core_order_fts_ai AFTER INSERT ON core_order BEGIN
+        INSERT INTO core_order_fts(rowid, username, telegram_id, article, check_number)
+        SELECT NEW.id, u.username, u.telegram_id, p.article, NEW.check_number
+        FROM core_telegramuser u, core_product p WHERE u.id = NEW.user_id AND p.id = NEW.product_id;
+    END""",
+    """CREATE TRIGGER core_order_fts_au AFTER UPDATE OF user_id, product_id, check_number ON core_order BEGIN
+        DELETE FROM core_order_fts WHERE rowid = OLD.id;
+        INSERT INTO core_order_fts(rowid, username, telegram_id, article, check_number)
+        SELECT NEW.id, u.username, u.telegram_id, p.article, NEW.check_number
+        FROM core_telegramuser u, core_product p WHERE u.id = NEW.user_id AND p.id = NEW.product_id;
+    END""",
+    """CREATE TRIGGER core_order_fts_ad AFTER DELETE ON core_order BEGIN
+        DELETE FROM core_order_fts WHERE rowid = OLD.id;
+    END""",
+    """CREATE TRIGGER core_order_fts_user_au AFTER UPDATE OF username, telegram_id ON core_telegramuser BEGIN
+        UPDATE core_order_fts SET username = NEW.username, telegram_id = NEW.telegram_id
+        WHERE rowid IN (SELECT id FROM core_order WHERE user_id = NEW.id);
+    END""",
+    """CREATE TRIGGER core_order_fts_product_au AFTER UPDATE OF article ON core_product BEGIN
+        UPDATE core_order_fts SET article = NEW.article
+        WHERE rowid IN (SELECT id FROM core_order WHERE product_id = NEW.id);
+    END""",
+    # --- Товары: название, артикул, описание ---
+    """CREATE VIRTUAL TABLE core_product_fts USING fts5(
+        name, article, description, tokenize='trigram')""",
+    """INSERT INTO core_product_fts(rowid, name, article, description)
+        SELECT id, name, article, description FROM core_product""",
+    """CREATE TRIGGER core_product_fts_ai AFTER INSERT ON core_product BEGIN
+        INSERT INTO core_product_fts(rowid, name, article, description) VALUES (NEW.id, NEW.name, NEW.article, NEW.description);
+    END""",
+    """CREATE TRIGGER core_product_fts_au AFTER UPDATE OF name, article, description ON core_product BEGIN
+        DELETE FROM core_product_fts WHERE rowid = OLD.id;
+        INSERT INTO core_product_fts(rowid, name, article, description) VALUES (NEW.id, NEW.name, NEW.article, NEW.description);
+    END""",
+    """CREATE TRIGGER core_product_fts_ad AFTER DELETE ON core_product BEGIN
+        DELETE FROM core_product_fts WHERE rowid = OLD.id;
+    END""",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS core_product_fts_ad",
+    "DROP TRIGGER IF EXISTS core_product_fts_au",
+    "DROP TRIGGER IF EXISTS core_product_fts_ai",
+    "DROP TABLE IF EXISTS core_product_fts",
+    "DROP TRIGGER IF EXISTS core_order_fts_product_au",
+    "DROP TRIGGER IF EXISTS core_order_fts_user_au",
+    "DROP TRIGGER IF EXISTS core_order_fts_ad",
+    "DROP TRIGGER IF EXISTS core_order_fts_au",
+    "DROP TRIGGER IF EXISTS core_order_fts_ai",
+    "DROP TABLE IF EXISTS core_order_fts",
+]
+
+# Индексы под UPPER(col) LIKE UPPER('%...%') — так Django строит icontains в Postgres
+POSTGRES_TRGM = [
+    ('core_telegramuser', 'username'),
+    ('core_telegramuser', 'telegram_id'),
+    ('core_product', 'article'),
+    ('core_product', 'name'),
+    ('core_order', 'check_number'),
+]
+
+
+def forward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_FORWARD:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for table, column in POSTGRES_TRGM:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm ON {table} '
+                f'USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+            )
+
+
+def backward(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_BACKWARD:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        for table, column in POSTGRES_TRGM:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_exportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
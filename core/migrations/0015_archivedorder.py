@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='balanceentry',
+            name='order',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='core.order', verbose_name='Заказ'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('ordered', 'Заказан (Ждет фото)'), ('check_wait', 'Ждет чек'), ('number_wait', 'Ждет номер чека'), ('received', 'Получен (На проверке)'), ('approved', 'Выплачено (Архив)'), ('rejected', 'Отклонено')], max_length=20, verbose_name='Статус')),
+                ('screenshot', models.ImageField(blank=True, null=True, upload_to='proofs/', verbose_name='Скрин ЛК')),
+                ('receipt_screenshot', models.ImageField(blank=True, null=True, upload_to='checks/', verbose_name='Скрин Чека')),
+                ('check_number', models.CharField(blank=True, max_length=255, null=True, verbose_name='Номер с чека')),
+                ('created_at', models.DateTimeField(verbose_name='Дата')),
+                ('is_archived', models.BooleanField(default=False, verbose_name='В архиве')),
+                ('moved_at', models.DateTimeField(auto_now_add=True, verbose_name='Перенесен в архив')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.product', verbose_name='Товар')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.telegramuser', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Заказ (архив)',
+                'verbose_name_plural': 'Заказы (холодный архив)',
+                'indexes': [models.Index(fields=['user', '-created_at'], name='archorder_user_created_idx'), models.Index(fields=['-created_at'], name='archorder_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_archivedorder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('screenshot', 'Скрин ЛК'), ('receipt', 'Скрин чека')], max_length=20, verbose_name='Тип')),
+                ('name', models.CharField(max_length=255, verbose_name='Файл')),
+                ('hash', models.CharField(max_length=16, verbose_name='dHash (hex)')),
+                ('band0', models.PositiveIntegerField(db_index=True)),
+                ('band1', models.PositiveIntegerField(db_index=True)),
+                ('band2', models.PositiveIntegerField(db_index=True)),
+                ('band3', models.PositiveIntegerField(db_index=True)),
+                ('distance', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Расстояние')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('duplicate_of', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='core.order', verbose_name='Похож на заказ')),
+                ('order', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='image_hashes', to='core.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Хеш скрина',
+                'verbose_name_plural': 'Хеши скринов',
+                'constraints': [models.UniqueConstraint(fields=('order', 'kind'), name='unique_hash_per_order_kind')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_imagehash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('parse_mode', models.CharField(blank=True, default='HTML', max_length=20, verbose_name='Разметка')),
+                ('paid', models.BooleanField(default=False, help_text='allow_paid_broadcast: до 1000 сообщений/сек за Telegram Stars', verbose_name='Платная рассылка')),
+                ('status', models.CharField(choices=[('draft', 'Черновик'), ('running', 'Идет рассылка'), ('paused', 'На паузе'), ('done', 'Завершена'), ('cancelled', 'Отменена')], default='draft', max_length=20, verbose_name='Статус')),
+                ('last_user_pk', models.BigIntegerField(default=0, verbose_name='Курсор (pk юзера)')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Получателей')),
+                ('delivered', models.PositiveIntegerField(default=0, verbose_name='Доставлено')),
+                ('blocked', models.PositiveIntegerField(default=0, verbose_name='Заблокировали бота')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Ошибок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Запущена')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Рассылка',
+                'verbose_name_plural': 'Рассылки',
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:37
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_queued_jobs(apps, schema_editor):
+    # Старые задачи хранили pickle запроса — такие больше не читаем, пусть запустят заново
+    ExportJob = apps.get_model('core', 'ExportJob')
+    ExportJob.objects.filter(status__in=('pending', 'running')).update(
+        status='failed', error='Выгрузка из старой версии, запустите ее еще раз', finished_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_broadcast'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_queued_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='exportjob',
+            name='query',
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Попыток'),
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Воркер был жив'),
+        ),
+        migrations.AddField(
+            model_name='exportjob',
+            name='selection',
+            field=models.JSONField(default=dict, verbose_name='Что выгружать'),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка'), ('expired', 'Файл удален')], default='pending', max_length=20, verbose_name='Статус'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_exportjob_selection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='thumbs_for',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, verbose_name='Превью готовы для'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbs_for',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True, verbose_name='Превью готовы для'),
+        ),
+    ]
@@ -1,4 +1,8 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Round
+from django.utils import timezone
 
 class TelegramUser(models.Model):
     telegram_id = models.BigIntegerField(unique=True, verbose_name="ID Telegram")
@@ -19,6 +23,8 @@ class Product(models.Model):
     wb_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Цена на WB")
     cashback_percent = models.IntegerField(default=100, verbose_name="% Кэшбэка")
     image = models.ImageField(upload_to='products/', null=True, blank=True, verbose_name="Обложка товара")
+    # null без default: SQLite добавит колонку без пересборки таблицы, на которую ссылаются триггеры поиска
+    thumbs_for = models.CharField(max_length=100, null=True, blank=True, editable=False, verbose_name="Превью готовы для")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена (в боте)")
     cashback = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Кэшбэк (фиксир.)")
     description = models.TextField(blank=True, default='', verbose_name="Описание")
@@ -39,6 +45,7 @@ class Product(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/gallery/', verbose_name="Фото")
+    thumbs_for = models.CharField(max_length=100, null=True, blank=True, editable=False, verbose_name="Превью готовы для")
     class Meta: verbose_name = "Фото галереи"; verbose_name_plural = "Галерея (Доп. фото)"
 
 class Order(models.Model):
@@ -70,6 +77,71 @@ class Order(models.Model):
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
+        constraints = [models.UniqueConstraint(fields=['user', 'product'], name='unique_order_user_product')]
+        indexes = [
+            # Бот: заказы юзера на нужном этапе (по id)
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            # WebApp: история заказов юзера, новые сверху
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # Админка: только не архивные (частичные индексы) + фильтры по статусу и дате
+            models.Index(fields=['-created_at'], condition=models.Q(is_archived=False), name='order_hot_date_idx'),
+            models.Index(fields=['status', '-created_at'], condition=models.Q(is_archived=False), name='order_hot_status_date_idx'),
+        ]
+
+class ArchivedOrder(models.Model):
+    """Холодный архив: старые завершенные заказы, перенесенные командой archive_orders."""
+    id = models.BigIntegerField(primary_key=True, verbose_name="ID")  # тот же id, что был в Order
+    user = models.ForeignKey(TelegramUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Товар")
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name="Статус")
+    screenshot = models.ImageField(upload_to='proofs/', null=True, blank=True, verbose_name="Скрин ЛК")
+    receipt_screenshot = models.ImageField(upload_to='checks/', null=True, blank=True, verbose_name="Скрин Чека")
+    check_number = models.CharField(max_length=255, blank=True, null=True, verbose_name="Номер с чека")
+    created_at = models.DateTimeField(verbose_name="Дата")
+    is_archived = models.BooleanField(default=False, verbose_name="В архиве")
+    moved_at = models.DateTimeField(auto_now_add=True, verbose_name="Перенесен в архив")
+
+    def __str__(self):
+        return f"Заказ #{self.id} - {self.user.username} (архив)"
+
+    class Meta:
+        verbose_name = "Заказ (архив)"
+        verbose_name_plural = "Заказы (холодный архив)"
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='archorder_user_created_idx'),
+            models.Index(fields=['-created_at'], name='archorder_created_idx'),
+        ]
+
+class DuplicateOrder(models.Model):
+    """Лишние заказы на ту же пару (юзер, товар), снятые миграцией 0010 перед уникальным ограничением."""
+    id = models.BigIntegerField(primary_key=True, verbose_name="ID")  # тот же id, что был в Order
+    kept_order_id = models.BigIntegerField(verbose_name="Оставленный заказ")
+    user = models.ForeignKey(TelegramUser, on_delete=models.CASCADE, verbose_name="Пользователь")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Товар")
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name="Статус")
+    screenshot = models.ImageField(upload_to='proofs/', null=True, blank=True, verbose_name="Скрин ЛК")
+    receipt_screenshot = models.ImageField(upload_to='checks/', null=True, blank=True, verbose_name="Скрин Чека")
+    check_number = models.CharField(max_length=255, blank=True, null=True, verbose_name="Номер с чека")
+    created_at = models.DateTimeField(verbose_name="Дата")
+    is_archived = models.BooleanField(default=False, verbose_name="В архиве")
+    moved_at = models.DateTimeField(auto_now_add=True, verbose_name="Снят как дубль")
+
+    def __str__(self):
+        return f"Дубль #{self.id} заказа #{self.kept_order_id}"
+
+    class Meta:
+        verbose_name = "Дубль заказа"
+        verbose_name_plural = "Дубли заказов (разобрать вручную)"
+
+def order_cashback_expr(prefix=''):
+    """Кэшбэк заказа в SQL: wb_price * cashback_percent / 100, округление до копеек."""
+    # Умножаем на 0.01, а не делим на 100: SQLite хранит круглую цену как INTEGER и делил бы нацело
+    percent = Value(Decimal('0.01'), output_field=models.DecimalField(max_digits=3, decimal_places=2))
+    return Round(
+        F(f'{prefix}product__wb_price') * F(f'{prefix}product__cashback_percent') * percent,
+        2,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
 
 class WithdrawalRequest(models.Model):
     STATUS_CHOICES = [('pending', 'Ожидает'), ('paid', 'Выплачено'), ('rejected', 'Отклонено')]
@@ -84,4 +156,133 @@ class CartItem(models.Model):
     user = models.ForeignKey(TelegramUser, on_delete=models.CASCADE, related_name='cart_items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
-    class Meta: unique_together = ('user', 'product'); verbose_name = "Товар в корзине"; verbose_name_plural = "Корзины пользователей"
\ No newline at end of file
+    class Meta: unique_together = ('user', 'product'); verbose_name = "Товар в корзине"; verbose_name_plural = "Корзины пользователей"
+
+class Outbox(models.Model):
+    STATUS_CHOICES = [('pending', 'В очереди'), ('sent', 'Отправлено'), ('failed', 'Ошибка')]
+    chat_id = models.BigIntegerField(verbose_name="Чат")
+    text = models.TextField(verbose_name="Текст")
+    parse_mode = models.CharField(max_length=20, default='HTML', blank=True, verbose_name="Разметка")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, default='', verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+
+    class Meta:
+        verbose_name = "Уведомление"
+        verbose_name_plural = "Очередь уведомлений"
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx')]
+
+
+class BalanceEntry(models.Model):
+    KIND_CHOICES = [
+        ('cashback', 'Кэшбэк за заказ'),
+        ('withdrawal', 'Вывод средств'),
+        ('adjustment', 'Корректировка'),
+    ]
+    user = models.ForeignKey(TelegramUser, on_delete=models.CASCADE, related_name='balance_entries', verbose_name="Пользователь")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Тип")
+    amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Сумма (+/−)")
+    # Без FK-ограничения в БД: заказ может уехать в ArchivedOrder с тем же id (см. archive_orders)
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, verbose_name="Заказ")
+    withdrawal = models.ForeignKey(WithdrawalRequest, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Заявка на вывод")
+    comment = models.CharField(max_length=255, blank=True, default='', verbose_name="Комментарий")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата")
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.amount} ₽ ({self.user})"
+
+    class Meta:
+        verbose_name = "Проводка по балансу"
+        verbose_name_plural = "Журнал баланса"
+        constraints = [
+            models.UniqueConstraint(fields=['order'], condition=models.Q(kind='cashback'), name='unique_cashback_per_order'),
+            models.UniqueConstraint(fields=['withdrawal'], condition=models.Q(kind='withdrawal'), name='unique_debit_per_withdrawal'),
+        ]
+        indexes = [models.Index(fields=['user', 'created_at'], name='balance_user_date_idx')]
+
+
+class ExportJob(models.Model):
+    STATUS_CHOICES = [('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка'),
+                      ('expired', 'Файл удален')]
+    FORMAT_CHOICES = [('xlsx', 'Excel (.xlsx)'), ('csv', 'CSV (.csv)')]
+    model = models.CharField(max_length=100, verbose_name="Модель")
+    # {"pks": [...]} — отмеченные строки, {"changelist": "status__exact=..."} — все по фильтрам списка в админке
+    selection = models.JSONField(default=dict, verbose_name="Что выгружать")
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='xlsx', verbose_name="Формат")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Статус")
+    total_rows = models.PositiveIntegerField(default=0, verbose_name="Всего строк")
+    rows_done = models.PositiveIntegerField(default=0, verbose_name="Выгружено строк")
+    file = models.FileField(upload_to='exports/', null=True, blank=True, verbose_name="Файл")
+    error = models.TextField(blank=True, default='', verbose_name="Ошибка")
+    created_by = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Кто запустил")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начато")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Воркер был жив")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+
+    def __str__(self):
+        return f"Выгрузка #{self.id} ({self.model}, {self.format})"
+
+    class Meta:
+        verbose_name = "Выгрузка"
+        verbose_name_plural = "Выгрузки"
+
+
+class ImageHash(models.Model):
+    """Перцептивный хеш (dHash, 64 бита) скрина заказа для поиска повторно присланных чеков."""
+    KIND_CHOICES = [('screenshot', 'Скрин ЛК'), ('receipt', 'Скрин чека')]
+    # Без FK-ограничения в БД, как у BalanceEntry: заказ может уехать в ArchivedOrder
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, related_name='image_hashes', verbose_name="Заказ")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Тип")
+    name = models.CharField(max_length=255, verbose_name="Файл")
+    hash = models.CharField(max_length=16, verbose_name="dHash (hex)")
+    # Хеш, порезанный на 4 части по 16 бит (multi-index hashing): у хешей на расстоянии
+    # Хэмминга <= 3 хотя бы одна часть совпадает точно, поэтому кандидаты ищутся по индексам
+    band0 = models.PositiveIntegerField(db_index=True)
+    band1 = models.PositiveIntegerField(db_index=True)
+    band2 = models.PositiveIntegerField(db_index=True)
+    band3 = models.PositiveIntegerField(db_index=True)
+    duplicate_of = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+', verbose_name="Похож на заказ")
+    distance = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Расстояние")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата")
+
+    def __str__(self):
+        return f"{self.get_kind_display()} заказа #{self.order_id}"
+
+    class Meta:
+        verbose_name = "Хеш скрина"
+        verbose_name_plural = "Хеши скринов"
+        constraints = [models.UniqueConstraint(fields=['order', 'kind'], name='unique_hash_per_order_kind')]
+
+
+class Broadcast(models.Model):
+    STATUS_CHOICES = [
+        ('draft', 'Черновик'), ('running', 'Идет рассылка'), ('paused', 'На паузе'),
+        ('done', 'Завершена'), ('cancelled', 'Отменена'),
+    ]
+    text = models.TextField(verbose_name="Текст")
+    parse_mode = models.CharField(max_length=20, default='HTML', blank=True, verbose_name="Разметка")
+    paid = models.BooleanField(default=False, verbose_name="Платная рассылка",
+                               help_text="allow_paid_broadcast: до 1000 сообщений/сек за Telegram Stars")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft', verbose_name="Статус")
+    # Курсор по TelegramUser.pk: все юзеры с pk <= last_user_pk уже взяты в работу и повторно не получат
+    last_user_pk = models.BigIntegerField(default=0, verbose_name="Курсор (pk юзера)")
+    total = models.PositiveIntegerField(default=0, verbose_name="Получателей")
+    delivered = models.PositiveIntegerField(default=0, verbose_name="Доставлено")
+    blocked = models.PositiveIntegerField(default=0, verbose_name="Заблокировали бота")
+    failed = models.PositiveIntegerField(default=0, verbose_name="Ошибок")
+    created_by = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Автор")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Запущена")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершена")
+
+    def __str__(self):
+        return f"Рассылка #{self.id}: {self.text[:40]}"
+
+    class Meta:
+        verbose_name = "Рассылка"
+        verbose_name_plural = "Рассылки"
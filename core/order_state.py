@@ -0,0 +1,92 @@
+import bisect
+import time
+from django.core.cache import cache
+from django.db import transaction
+from .models import TelegramUser, Order
+from .db_executor import bot_db
+
+# --- КЭШ СОСТОЯНИЯ ЗАКАЗОВ ДЛЯ БОТА ---
+# Бот держит в памяти, на каком этапе активные заказы каждого юзера, и отвечает
+# на "пустые" сообщения без запросов в БД. Заказы меняют админка, WebApp и другие
+# реплики бота, поэтому у каждого юзера в общем кэше есть версия: любой переход
+# заказа ее меняет, а бот перед ответом сверяет свою копию с версией (одно чтение
+# кэша вместо запросов в БД) и перечитывает только этого юзера.
+VERSION_KEY = 'order_state:user:{}'
+VERSION_TTL = 24 * 3600  # пропавший ключ тоже считается новой версией
+MAX_USERS = 50000
+TRACKED_STATUSES = ('ordered', 'check_wait', 'number_wait')
+
+
+def invalidate_order_states(telegram_ids):
+    """Новая версия состояния для юзеров. Возвращает ее (бот запоминает у себя)."""
+    version = time.time_ns()
+    keys = {VERSION_KEY.format(telegram_id): version for telegram_id in set(telegram_ids)}
+    if keys: cache.set_many(keys, timeout=VERSION_TTL)
+    return version
+
+
+def invalidate_users(user_pks):
+    """То же по pk TelegramUser (заказы знают только user_id), после коммита текущей транзакции."""
+    # Версия, поднятая до коммита, позволила бы боту закэшировать старые заказы под новой версией
+    user_pks = set(user_pks)
+    if user_pks:
+        transaction.on_commit(lambda: invalidate_order_states(
+            TelegramUser.objects.filter(pk__in=user_pks).values_list('telegram_id', flat=True)))
+
+
+class UserOrderState:
+    """Активные заказы юзера по этапам: {статус: [(order_id, название товара), ...]} по возрастанию id."""
+    __slots__ = ('user_pk', 'orders', 'version')
+
+    def __init__(self, user_pk):
+        self.user_pk = user_pk
+        self.version = None
+        self.orders = {status: [] for status in TRACKED_STATUSES}
+
+    def last(self, status):
+        items = self.orders[status]
+        return items[-1] if items else None
+
+    def move(self, order_id, product_name, old_status, new_status):
+        self.orders[old_status] = [o for o in self.orders[old_status] if o[0] != order_id]
+        if new_status in self.orders:
+            bisect.insort(self.orders[new_status], (order_id, product_name))
+
+
+class OrderStateCache:
+    def __init__(self, max_users=MAX_USERS):
+        self.max_users = max_users
+        self.states = {}
+
+    @staticmethod
+    def _load(telegram_id):
+        user_pk = TelegramUser.objects.filter(telegram_id=telegram_id).values_list('pk', flat=True).first()
+        state = UserOrderState(user_pk)
+        if user_pk is not None:
+            orders = Order.objects.filter(user_id=user_pk, status__in=TRACKED_STATUSES).order_by('id')
+            for order_id, status, product_name in orders.values_list('id', 'status', 'product__name'):
+                state.orders[status].append((order_id, product_name))
+        return state
+
+    async def get(self, telegram_id):
+        # Версию читаем до загрузки: если заказ поменяют во время _load, следующий get перечитает
+        version = await bot_db.run(cache.get, VERSION_KEY.format(telegram_id))
+        state = self.states.get(telegram_id)
+        if state is None or state.version != version:
+            self.states.pop(telegram_id, None)
+            state = await bot_db.run(self._load, telegram_id)
+            state.version = version
+            if len(self.states) >= self.max_users:
+                self.states.pop(next(iter(self.states)))
+            self.states[telegram_id] = state
+        return state
+
+    async def publish(self, telegram_id, state):
+        """Бот сам перевел заказ (update() без сигналов): сообщаем другим репликам, свою копию оставляем."""
+        state.version = await bot_db.run(invalidate_order_states, [telegram_id])
+
+    def forget(self, telegram_id):
+        self.states.pop(telegram_id, None)
+
+    def clear(self):
+        self.states.clear()
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from django.utils import timezone
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from .models import Outbox
+from .db_executor import bot_db
+
+logger = logging.getLogger(__name__)
+
+# --- ОЧЕРЕДЬ УВЕДОМЛЕНИЙ ---
+# Веб-часть только пишет сообщение в таблицу Outbox (в той же транзакции, что и заказ),
+# а отправляет его воркер внутри процесса бота. HTTP-запрос никогда не ждет Telegram.
+BATCH_SIZE = 50
+IDLE_SLEEP = 1.0
+GLOBAL_RATE = 25          # сообщений в секунду на бота (лимит Telegram ~30)
+PER_CHAT_INTERVAL = 1.0   # не чаще 1 сообщения в секунду в один чат
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 600
+
+
+def queue_message(chat_id, text, parse_mode='HTML'):
+    return Outbox.objects.create(chat_id=chat_id, text=text, parse_mode=parse_mode)
+
+
+class RateLimiter:
+    """Глобальный лимит (равномерно) + минимальный интервал для каждого чата.
+    Фоновые отправки (рассылки) занимают только свободный слот "прямо сейчас", а уведомления
+    бронируют слоты вперед — поэтому уведомления о заказах не стоят в очереди за рассылкой."""
+
+    def __init__(self, rate=GLOBAL_RATE, per_chat=PER_CHAT_INTERVAL):
+        self.interval = 1 / rate
+        self.per_chat = per_chat
+        self.next_slot = 0.0
+        self.chat_ready = {}
+        self.background_lock = asyncio.Lock()  # фоновые ждут слот по одному, а не всей толпой
+
+    def chat_delay(self, chat_id):
+        return max(0.0, self.chat_ready.get(chat_id, 0.0) - time.monotonic())
+
+    async def wait(self, chat_id, background=False):
+        if background:
+            # Рассылка пишет в чат один раз: интервал чата соблюдаем, но в chat_ready не запоминаем,
+            # иначе словарь рос бы на всех получателей
+            delay = self.chat_delay(chat_id)
+            if delay: await asyncio.sleep(delay)
+            async with self.background_lock:
+                while self.next_slot > time.monotonic():
+                    await asyncio.sleep(self.next_slot - time.monotonic())
+                self.next_slot = time.monotonic() + self.interval
+            return
+
+        now = time.monotonic()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + self.interval
+        if slot > now: await asyncio.sleep(slot - now)
+        self.chat_ready[chat_id] = time.monotonic() + self.per_chat
+        if len(self.chat_ready) > 10000:
+            now = time.monotonic()
+            self.chat_ready = {k: v for k, v in self.chat_ready.items() if v > now}
+
+    def pause(self, seconds):
+        # 429 от Telegram без привязки к чату — тормозим всю отправку
+        self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+def backoff(attempts):
+    return min(2 ** attempts, MAX_BACKOFF)
+
+
+async def mark(msg, **fields):
+    await bot_db.run(Outbox.objects.filter(id=msg.id).update, **fields)
+
+
+async def send_one(bot, limiter, msg):
+    await limiter.wait(msg.chat_id)
+    try:
+        await bot.send_message(msg.chat_id, msg.text, parse_mode=msg.parse_mode or None)
+    except TelegramRetryAfter as e:
+        limiter.pause(e.retry_after)
+        await mark(msg, next_attempt_at=timezone.now() + timedelta(seconds=e.retry_after), last_error=str(e))
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # Юзер заблокировал бота / битый текст — повтор не поможет
+        await mark(msg, status='failed', attempts=msg.attempts + 1, last_error=str(e))
+    except Exception as e:
+        attempts = msg.attempts + 1
+        await mark(
+            msg,
+            status='failed' if attempts >= MAX_ATTEMPTS else 'pending',
+            attempts=attempts,
+            next_attempt_at=timezone.now() + timedelta(seconds=backoff(attempts)),
+            last_error=str(e))
+        logger.warning("Outbox #%s: %s", msg.id, e)
+    else:
+        await mark(msg, status='sent', attempts=msg.attempts + 1, sent_at=timezone.now(), last_error='')
+
+
+async def drain_once(bot, limiter):
+    """Отправляет одну пачку. Возвращает количество обработанных сообщений."""
+    due = Outbox.objects.filter(status='pending', next_attempt_at__lte=timezone.now()).order_by('id')[:BATCH_SIZE]
+    batch = await bot_db.run(list, due)
+    done = 0
+    for msg in batch:
+        # Чат, в который только что писали, не ждем — откладываем до следующей пачки
+        delay = limiter.chat_delay(msg.chat_id)
+        if delay > 0:
+            await mark(msg, next_attempt_at=timezone.now() + timedelta(seconds=delay))
+            continue
+        await send_one(bot, limiter, msg)
+        done += 1
+    return done
+
+
+async def run_outbox_worker(bot, limiter=None):
+    # limiter общий с рассылками (core/broadcast.py): лимит Telegram — на бота, а не на воркер
+    limiter = limiter or RateLimiter()
+    while True:
+        try:
+            done = await drain_once(bot, limiter)
+        except Exception:
+            logger.exception("Outbox worker error")
+            done = 0
+        if not done: await asyncio.sleep(IDLE_SLEEP)
@@ -0,0 +1,101 @@
+import logging
+from functools import lru_cache
+from itertools import combinations
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from .models import ImageHash
+
+logger = logging.getLogger(__name__)
+
+# --- ПОИСК ПОВТОРНЫХ СКРИНОВ ---
+# dHash: картинка сжимается до 9x8 в оттенках серого, каждый бит — "левый пиксель ярче правого".
+# Пересжатие, другой размер или пара пикселей интерфейса меняют всего несколько бит,
+# поэтому повторно присланный чек находится по расстоянию Хэмминга, а не по sha256.
+# Поиск точный при любом пороге: если хеши различаются не больше чем на MAX_DISTANCE бит,
+# хотя бы одна из BANDS частей различается не больше чем на MAX_DISTANCE // BANDS бит,
+# поэтому по индексам частей ищем все их варианты в этом радиусе.
+HASH_SIZE = 8
+BANDS = 4
+BAND_BITS = HASH_SIZE * HASH_SIZE // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+# Пересжатие и масштаб дают 0-2 бита, обрезка краев и статус-бара — до 5-8;
+# разные чеки одного магазина с той же версткой могут отличаться всего на 10-12 бит,
+# поэтому порог подбирается по своим данным: manage.py hash_screenshots --calibrate
+MAX_DISTANCE = settings.PHASH_MAX_DISTANCE
+FIELD_KINDS = (('screenshot', 'screenshot'), ('receipt_screenshot', 'receipt'))
+
+
+def dhash(fileobj):
+    with Image.open(fileobj) as img:
+        img = ImageOps.exif_transpose(img).convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    px = img.load()
+    value = 0
+    for y in range(HASH_SIZE):
+        for x in range(HASH_SIZE):
+            value = value << 1 | (px[x, y] > px[x + 1, y])
+    return value
+
+
+def split_bands(value):
+    return [(value >> (i * BAND_BITS)) & BAND_MASK for i in range(BANDS)]
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+@lru_cache(maxsize=None)
+def flip_masks(radius):
+    """XOR-маски всех изменений части не больше чем в radius битах (включая 0)."""
+    return [sum(1 << bit for bit in bits) for k in range(radius + 1) for bits in combinations(range(BAND_BITS), k)]
+
+
+def find_similar(value, exclude_order=None, before_order=None):
+    """[(расстояние, order_id)] по возрастанию: кандидаты по индексам частей, проверка в Python."""
+    masks = flip_masks(MAX_DISTANCE // BANDS)
+    q = Q()
+    for i, band in enumerate(split_bands(value)): q |= Q(**{f'band{i}__in': [band ^ mask for mask in masks]})
+    candidates = ImageHash.objects.filter(q)
+    if exclude_order is not None: candidates = candidates.exclude(order_id=exclude_order)
+    if before_order is not None: candidates = candidates.filter(order_id__lt=before_order)
+    found = {}
+    for order_id, hex_hash in candidates.values_list('order_id', 'hash').iterator():
+        dist = hamming(value, int(hex_hash, 16))
+        if dist <= MAX_DISTANCE and dist < found.get(order_id, MAX_DISTANCE + 1):
+            found[order_id] = dist
+    return sorted((dist, order_id) for order_id, dist in found.items())
+
+
+def record_hash(order_id, kind, name, value=None):
+    """Сохраняет хеш файла name вместе с самым похожим старым заказом.
+    value — уже посчитанный dHash (бот считает его в пуле обработки фото)."""
+    if not name: return None
+    if value is None:
+        try:
+            with default_storage.open(name, 'rb') as f: value = dhash(f)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.warning("Не удалось посчитать хеш %s", name)
+            return None
+
+    similar = find_similar(value, exclude_order=order_id)
+    dist, dup_id = similar[0] if similar else (None, None)
+    entry, _ = ImageHash.objects.update_or_create(
+        order_id=order_id, kind=kind,
+        defaults=dict(
+            name=name, hash=f"{value:016x}", duplicate_of_id=dup_id, distance=dist,
+            **{f'band{i}': band for i, band in enumerate(split_bands(value))},
+        ),
+    )
+    return entry
+
+
+def record_order_hashes(order):
+    """Хеширует скрины заказа, которые еще не хешированы или заменены. Для Order и ArchivedOrder."""
+    known = dict(ImageHash.objects.filter(order_id=order.pk).values_list('kind', 'name'))
+    done = 0
+    for field, kind in FIELD_KINDS:
+        name = getattr(order, field).name
+        if name and known.get(kind) != name and record_hash(order.pk, kind, name): done += 1
+    return done
@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+# --- ОБРАБОТКА ФОТО ВНЕ ЦИКЛА СОБЫТИЙ ---
+# Скрин из Telegram декодируется, поворачивается по EXIF, теряет метаданные, уменьшается,
+# если слишком большой, и пересохраняется в WebP. Заодно считается dHash для поиска дублей.
+# Все это CPU и держит GIL, поэтому идет в отдельные процессы. Очередь ограничена:
+# при всплеске загрузок фото ждут место QUEUE_TIMEOUT секунд, потом бот просит прислать позже.
+WORKERS = int(os.getenv('BOT_PHOTO_WORKERS', min(2, os.cpu_count() or 1)))
+MAX_QUEUE = int(os.getenv('BOT_PHOTO_QUEUE', 16))
+QUEUE_TIMEOUT = 10
+MAX_SIDE = 2000
+MAX_PIXELS = 40_000_000  # больше — точно не скрин, не декодируем
+WEBP_QUALITY = 80
+
+
+class PhotoBusy(Exception):
+    """Очередь обработки заполнена."""
+
+
+class PhotoRejected(Exception):
+    """Файл не удалось прочитать как картинку."""
+
+
+def _init_worker():
+    # spawn-процесс стартует с нуля; Django нужен только ради core.phash.dhash
+    import django
+    django.setup()
+
+
+def process_photo(src_path, dst_path):
+    """Выполняется в процессе пула. Пишет WebP в dst_path, возвращает (sha256, dhash)."""
+    from core.phash import dhash
+    try:
+        with Image.open(src_path) as img:
+            if img.width * img.height > MAX_PIXELS: raise PhotoRejected(f"{img.width}x{img.height}")
+            img = ImageOps.exif_transpose(img)
+            img.load()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise PhotoRejected(str(e)) from None
+
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    if max(img.size) > MAX_SIDE:
+        img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+    # exif/icc не передаем — в файл попадают только пиксели
+    img.save(dst_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+
+    sha256 = hashlib.sha256()
+    with open(dst_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''): sha256.update(chunk)
+    with open(dst_path, 'rb') as f:
+        value = dhash(f)
+    return sha256.hexdigest(), value
+
+
+class PhotoPool:
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE):
+        self.configure(workers, max_queue)
+        self.pool = None
+
+    def configure(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max(max_queue, workers)
+        self.slots = self.loop = None  # семафор привязан к циклу, в котором работает бот
+
+    async def process(self, src_path, dst_path):
+        if self.pool is None:
+            # spawn, а не fork: у бота уже есть потоки (пул БД), fork с ними небезопасен
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker)
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop: self.slots, self.loop = asyncio.Semaphore(self.max_queue), loop
+        try:
+            await asyncio.wait_for(self.slots.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PhotoBusy() from None
+        try:
+            return await loop.run_in_executor(self.pool, process_photo, src_path, dst_path)
+        finally:
+            self.slots.release()
+
+    def shutdown(self):
+        if self.pool is not None: self.pool.shutdown(wait=True, cancel_futures=True)
+        self.pool = None
+        self.slots = self.loop = None
+
+
+photo_pool = PhotoPool()
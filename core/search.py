@@ -0,0 +1,34 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+# --- ПОЛНОТЕКСТОВЫЙ ПОИСК ---
+# SQLite: FTS5-таблицы с триграммным токенизатором (ищут подстроку, как icontains,
+# но по индексу). Синхронизируются триггерами — см. миграцию 0014_search_index.
+# Postgres: обычный icontains, его ускоряют GIN-индексы pg_trgm из той же миграции.
+MIN_TERM_LENGTH = 3  # триграммы не находят строки короче 3 символов
+
+ORDER_FTS = 'core_order_fts'
+PRODUCT_FTS = 'core_product_fts'
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def fts_query(search_term, columns=None):
+    """Строка для MATCH или None, если искать через FTS нельзя (пусто / короткие слова)."""
+    terms = search_term.split()
+    if not terms or any(len(t) < MIN_TERM_LENGTH for t in terms):
+        return None
+    phrases = ' AND '.join('"' + t.replace('"', '""') + '"' for t in terms)
+    if columns:
+        return '{' + ' '.join(columns) + '}: (' + phrases + ')'
+    return phrases
+
+
+def fts_filter(queryset, table, search_term, columns=None):
+    """queryset, ограниченный совпадениями из FTS-таблицы, или None — тогда ищем по-старому."""
+    if not fts_enabled(): return None
+    match = fts_query(search_term, columns)
+    if match is None: return None
+    return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [match]))
@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Product, ProductImage, Order
+from .cache import bump_catalog_version
+from .thumbnails import make_thumbnails, delete_thumbnails
+from .order_state import invalidate_users
+from .phash import record_order_hashes
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductImage)
+def remember_image(sender, instance, **kwargs):
+    # Запоминаем прежнюю картинку, чтобы после замены убрать ее превью
+    instance._old_image = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def create_thumbnails(sender, instance, **kwargs):
+    try: make_thumbnails(instance.image)
+    except (OSError, ValueError): pass  # битая картинка — превью не будет, make_thumbnails покажет ошибку
+    old = getattr(instance, '_old_image', None)
+    if old and old != instance.image.name:
+        transaction.on_commit(lambda: delete_thumbnails(old))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def remove_thumbnails(sender, instance, **kwargs):
+    delete_thumbnails(instance.image.name if instance.image else None)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_catalog(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_bot_order_states(sender, instance, **kwargs):
+    invalidate_users([instance.user_id])
+
+
+@receiver(post_save, sender=Order)
+def hash_order_screenshots(sender, instance, **kwargs):
+    # Скрины из админки; бот пишет через update() и хеширует сам
+    record_order_hashes(instance)
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+from django.conf import settings
+from .metrics import BOT_DOWNLOAD_SECONDS
+from .photo_pipeline import photo_pool
+
+# --- ХРАНИЛИЩЕ ФОТО ПО ХЕШУ ---
+# Файл сохраняется как <kind>/ab/cd/<sha256>.webp: каталоги не разрастаются,
+# а одинаковые скрины (присланные повторно) лежат на диске один раз.
+TMP_DIR = 'tmp'
+
+
+def blob_name(kind, digest, ext='jpg'):
+    return f"{kind}/{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+def _temp_file():
+    tmp_dir = os.path.join(settings.MEDIA_ROOT, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+
+
+def commit_blob(tmp_path, kind, digest, ext='jpg'):
+    """Переносит временный файл на место по хешу. Дубликат просто удаляется."""
+    name = blob_name(kind, digest, ext)
+    full_path = os.path.join(settings.MEDIA_ROOT, name)
+    if os.path.exists(full_path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.replace(tmp_path, full_path)
+    return name
+
+
+async def download_photo(bot, file_path, kind):
+    """Скачивает фото из Telegram и прогоняет через пул обработки (core/photo_pipeline.py).
+    Возвращает (имя для ImageField, dHash). Может бросить PhotoBusy / PhotoRejected."""
+    raw = _temp_file()
+    out = f"{raw.name}.webp"
+    start = time.perf_counter()
+    try:
+        with raw:
+            await bot.download_file(file_path, destination=raw, seek=False)
+        BOT_DOWNLOAD_SECONDS.observe(time.perf_counter() - start, kind)
+        digest, image_hash = await photo_pool.process(raw.name, out)
+        return commit_blob(out, kind, digest, ext='webp'), image_hash
+    finally:
+        for path in (raw.name, out):
+            if os.path.exists(path): os.remove(path)
@@ -0,0 +1,14 @@
+from django import template
+from core.thumbnails import thumb_srcset, thumb_url
+
+register = template.Library()
+
+
+@register.filter
+def srcset(field_file):
+    return thumb_srcset(field_file)
+
+
+@register.filter
+def thumb(field_file, width):
+    return thumb_url(field_file, int(width))
@@ -0,0 +1,229 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock, skipUnless
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from core.admin import EstimatedCountPaginator, OrderAdmin
+from core.models import TelegramUser, Product, Order, BalanceEntry
+from core.order_state import TRACKED_STATUSES, VERSION_KEY
+from core.thumbnails import thumb_url, thumb_srcset
+
+
+def hot_queries():
+    """Запросы, которые выполняются чаще всего (бот, WebApp, список заказов в админке), и подходящие индексы."""
+    # Заказов у юзера немного, поэтому SQLite вправе взять и простой индекс по user_id (FK)
+    by_user = ('order_user_status_idx', 'core_order_user_id_')
+    week_ago = timezone.now() - timedelta(days=7)
+    return [
+        ('bot: активные заказы юзера', by_user,
+         Order.objects.filter(user_id=1, status__in=TRACKED_STATUSES).order_by('id').values_list('id', 'status', 'product__name')),
+        ('bot: заказ юзера на этапе', by_user,
+         Order.objects.filter(user_id=1, status='number_wait').order_by('-id')[:1]),
+        ('webapp: история заказов', ('order_user_created_idx',),
+         Order.objects.select_related('product').filter(user_id=1).order_by('-created_at')),
+        # Порядок как в OrderAdmin: ordering + '-pk', который админка добавляет сама
+        ('admin: не в архиве', ('order_hot_date_idx',),
+         Order.objects.filter(is_archived=False).order_by('-created_at', '-pk')[:100]),
+        ('admin: статус', ('order_hot_status_date_idx',),
+         Order.objects.filter(is_archived=False, status='received').order_by('-created_at', '-pk')[:100]),
+        ('admin: дата', ('order_hot_date_idx',),
+         Order.objects.filter(is_archived=False, created_at__gte=week_ago).order_by('-created_at', '-pk')[:100]),
+        ('admin: статус + дата', ('order_hot_status_date_idx',),
+         Order.objects.filter(is_archived=False, status='received', created_at__gte=week_ago).order_by('-created_at', '-pk')[:100]),
+    ]
+
+
+@skipUnless(connection.vendor == 'sqlite', "Планы проверяются по EXPLAIN QUERY PLAN из SQLite")
+class OrderQueryPlanTests(TestCase):
+    """Горячие запросы к core_order не должны скатываться в полный скан таблицы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Планировщик выбирает индекс по статистике: заполняем таблицу похоже на прод и делаем ANALYZE
+        users = TelegramUser.objects.bulk_create([TelegramUser(telegram_id=i) for i in range(1, 101)])
+        products = Product.objects.bulk_create([Product(name=f"Товар {i}", price=100) for i in range(40)])
+        statuses = [code for code, _ in Order.STATUS_CHOICES]
+        Order.objects.bulk_create([
+            Order(user=u, product=p, status=statuses[(u.pk + p.pk) % len(statuses)], is_archived=(u.pk + p.pk) % 5 != 0)
+            for u in users for p in products
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_hot_queries_use_indexes(self):
+        table = Order._meta.db_table
+        for name, indexes, queryset in hot_queries():
+            with self.subTest(name):
+                plan = self.plan(queryset)
+                order_steps = [line for line in plan if f' {table} ' in f'{line} ']
+                self.assertFalse([line for line in order_steps if 'INDEX' not in line],
+                                 f"Полный скан {table}:\n" + "\n".join(plan))
+                self.assertTrue(any(index in line for line in order_steps for index in indexes),
+                                f"Ожидался индекс {' / '.join(indexes)}:\n" + "\n".join(plan))
+
+
+class ApproveOrdersTests(TestCase):
+    """Экшен "Выплачено" начисляет кэшбэк с копейками, как прежний расчет в Decimal."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        self.user = TelegramUser.objects.create(telegram_id=1)
+
+    def approve(self, *orders):
+        return self.client.post(reverse('admin:core_order_changelist'), {
+            'action': 'set_approved', '_selected_action': [o.pk for o in orders],
+        })
+
+    def test_non_round_cashback(self):
+        product = Product.objects.create(name="Товар", price=100, wb_price=Decimal('999'), cashback_percent=15)
+        order = Order.objects.create(user=self.user, product=product, status='received')
+        self.approve(order)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('149.85'))
+        self.assertEqual(BalanceEntry.objects.get(order=order, kind='cashback').amount, Decimal('149.85'))
+
+    def test_approved_once(self):
+        product = Product.objects.create(name="Товар", price=100, wb_price=Decimal('333.33'), cashback_percent=33)
+        order = Order.objects.create(user=self.user, product=product, status='received')
+        self.approve(order)
+        self.approve(order)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, Decimal('110.00'))
+
+
+class ThumbnailFallbackTests(TestCase):
+    """Пока превью не созданы, карточка показывает оригинал, а не битую ссылку."""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def save_image(self, product, content):
+        product.image.save('cover.png', ContentFile(content))
+        return Product.objects.get(pk=product.pk)
+
+    def test_thumbs_after_save(self):
+        buf = BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(buf, 'PNG')
+        product = self.save_image(Product.objects.create(name="Товар", price=1), buf.getvalue())
+        self.assertTrue(thumb_url(product.image, 320).endswith('_png_320.webp'))
+        self.assertIn('640w', thumb_srcset(product.image))
+
+    def test_broken_image_falls_back(self):
+        product = self.save_image(Product.objects.create(name="Товар", price=1), b'not an image')
+        self.assertEqual(thumb_url(product.image, 320), product.image.url)
+        self.assertEqual(thumb_srcset(product.image), "")
+
+    def test_existing_image_without_thumbs(self):
+        product = Product.objects.create(name="Товар", price=1)
+        Product.objects.filter(pk=product.pk).update(image='products/old.jpg')
+        product.refresh_from_db()
+        self.assertEqual(thumb_url(product.image, 640), product.image.url)
+
+
+class OrderStateInvalidationTests(TestCase):
+    """Версия состояния бота меняется только после коммита, иначе бот закэширует незакоммиченное."""
+
+    def test_version_bumped_on_commit(self):
+        user = TelegramUser.objects.create(telegram_id=77)
+        product = Product.objects.create(name="Товар", price=1)
+        key = VERSION_KEY.format(user.telegram_id)
+        cache.delete(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(user=user, product=product)
+            self.assertIsNone(cache.get(key))
+        self.assertIsNotNone(cache.get(key))
+
+
+class MetricsAccessTests(TestCase):
+    """/metrics закрыт, пока нет токена или явного METRICS_PUBLIC, даже при DEBUG."""
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=False, DEBUG=True)
+    def test_private_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=True)
+    def test_public_opt_in(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_PUBLIC=True)
+    def test_token_required_when_set(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'authorization': 'Bearer secret'}).status_code, 200)
+
+
+@mock.patch.object(OrderAdmin, 'list_per_page', 10)
+@mock.patch.object(EstimatedCountPaginator, 'COUNT_LIMIT', 5)
+@mock.patch.object(EstimatedCountPaginator, 'estimate', lambda self, qs: 1000)
+class OrderChangeListPaginationTests(TestCase):
+    """Завышенная оценка числа заказов не уводит ссылки за конец списка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = TelegramUser.objects.create(telegram_id=1)
+        products = Product.objects.bulk_create([Product(name=f"Товар {i}", price=1) for i in range(25)])
+        Order.objects.bulk_create([Order(user=user, product=p) for p in products])
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+
+    def changelist(self, **params):
+        response = self.client.get(reverse('admin:core_order_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context_data
+
+    def test_short_page_clamps_count(self):
+        cl = self.changelist(p=3)['cl']
+        self.assertEqual(len(cl.result_list), 5)
+        self.assertEqual(cl.result_count, 25)
+        self.assertEqual(cl.paginator.num_pages, 3)
+
+    def test_link_past_end_shows_last_page(self):
+        cl = self.changelist(p=40)['cl']
+        self.assertEqual((cl.page_num, cl.result_count, len(cl.result_list)), (3, 25, 5))
+
+    def test_keyset_next_hidden_at_end(self):
+        # 20 заказов: вторая страница полная, но за ней ничего нет
+        Order.objects.filter(pk__in=Order.objects.order_by('pk').values('pk')[:5]).delete()
+        first = self.changelist()
+        self.assertIn('keyset_next', first)
+        second = self.changelist(before=first['cl'].result_list[9].pk)
+        self.assertEqual(len(second['cl'].result_list), 10)
+        self.assertNotIn('keyset_next', second)
+
+
+class CatalogETagTests(TestCase):
+    """If-None-Match сравнивается по RFC 9110: слабые валидаторы, списки и * дают 304."""
+
+    def setUp(self):
+        Product.objects.create(name="Товар", price=1)
+        self.etag = self.client.get('/api/catalog/')['ETag']
+
+    def status(self, if_none_match):
+        return self.client.get('/api/catalog/', headers={'if-none-match': if_none_match}).status_code
+
+    def test_matches(self):
+        for value in (self.etag, f"W/{self.etag}", f'"other", {self.etag}', '*'):
+            with self.subTest(value):
+                self.assertEqual(self.status(value), 304)
+
+    def test_mismatch(self):
+        self.assertEqual(self.status('"other"'), 200)
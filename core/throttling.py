@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+
+# --- ЗАЩИТА БОТА ОТ ФЛУДА ---
+# У каждого юзера свое ведро токенов: сообщение тратит токены, ведро пополняется со скоростью RATE.
+# Пустое ведро — апдейт выкидывается до хендлеров (ни запросов в БД, ни скачивания файлов),
+# а юзер один раз получает предупреждение. Альбом (media_group_id) и повтор того же фото
+# (file_unique_id) за DUPLICATE_WINDOW секунд с момента, когда фото дошло до хендлера,
+# считаются одной загрузкой. Если хендлер попросил прислать фото заново (вернул ALLOW_RESEND
+# или упал), фото забывается, и его повтор сразу проходит.
+RATE = 1.0              # токенов в секунду
+BURST = 5               # емкость ведра
+TEXT_COST = 1
+PHOTO_COST = 2          # фото дороже: скачивание, обработка, запись на диск
+DUPLICATE_WINDOW = 10.0
+MAX_TRACKED = 50000
+WARNING_TEXT = "⏳ Слишком много сообщений. Подождите немного и отправьте еще раз."
+ALLOW_RESEND = 'allow_resend'  # результат хендлера: фото не принято, повтор не считать дублем
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated_at', 'warned')
+
+    def __init__(self, now):
+        self.tokens = BURST
+        self.updated_at = now
+        self.warned = False
+
+    def take(self, cost, now):
+        self.tokens = min(BURST, self.tokens + (now - self.updated_at) * RATE)
+        self.updated_at = now
+        if self.tokens < cost: return False
+        self.tokens -= cost
+        self.warned = False
+        return True
+
+
+class LRU(OrderedDict):
+    """dict с ограничением размера: самые давние ключи вытесняются."""
+
+    def __init__(self, max_size=MAX_TRACKED):
+        super().__init__()
+        self.max_size = max_size
+
+    def touch(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        if len(self) > self.max_size: self.popitem(last=False)
+
+
+class ThrottlingMiddleware:
+    """Outer-middleware для dp.message: лимит на telegram_id, склейка альбомов и повторных фото."""
+
+    def __init__(self):
+        self.buckets = LRU()
+        self.recent_uploads = LRU()  # (user, media_group_id | file_unique_id) -> до какого времени считать повтором
+
+    @staticmethod
+    def upload_keys(user_id, message):
+        if not message.photo: return []
+        keys = [(user_id, 'photo', message.photo[-1].file_unique_id)]
+        if message.media_group_id: keys.append((user_id, 'album', message.media_group_id))
+        return keys
+
+    def forget_uploads(self, keys):
+        for key in keys: self.recent_uploads.pop(key, None)
+
+    async def __call__(self, handler, event, data):
+        user = event.from_user
+        if user is None: return await handler(event, data)
+        now = time.monotonic()
+
+        # Окно не продлеваем: повтор, пришедший позже DUPLICATE_WINDOW от принятого фото, пройдет
+        keys = self.upload_keys(user.id, event)
+        if any(self.recent_uploads.get(key, 0) > now for key in keys):
+            return None
+
+        bucket = self.buckets.get(user.id)
+        if bucket is None: bucket = TokenBucket(now)
+        self.buckets.touch(user.id, bucket)
+        if not bucket.take(PHOTO_COST if event.photo else TEXT_COST, now):
+            # Отклоненное фото загрузкой не считается — после паузы его можно прислать снова
+            if not bucket.warned:
+                bucket.warned = True
+                await event.answer(WARNING_TEXT)
+            return None
+
+        # Ключи ставим до хендлера: части альбома приходят параллельно
+        for key in keys: self.recent_uploads.touch(key, now + DUPLICATE_WINDOW)
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            self.forget_uploads(keys)
+            raise
+        # Альбом остается склеенным (повторно присланный альбом придет с новым media_group_id)
+        if result == ALLOW_RESEND: self.forget_uploads(keys[:1])
+        return result
@@ -0,0 +1,83 @@
+import os
+from io import BytesIO
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# --- ПРЕВЬЮ ТОВАРОВ ---
+# Для каждой картинки товара храним уменьшенные копии в WebP рядом с оригиналом:
+# products/1.jpg -> products/thumbs/1_jpg_320.webp, products/thumbs/1_jpg_640.webp
+# Расширение входит в имя, чтобы 1.jpg и 1.png не делили одни превью.
+# Превью создаются при сохранении (сигнал) и командой make_thumbnails. Генератор пишет
+# в thumbs_for имя картинки, для которой превью готовы: по нему URL выбираем без
+# обращения к хранилищу, а пока превью нет (старый товар, битый файл) отдаем оригинал.
+THUMB_WIDTHS = (320, 640)
+THUMB_QUALITY = 80
+
+
+def thumb_name(name, width):
+    folder, filename = os.path.split(name)
+    base, ext = os.path.splitext(filename)
+    suffix = f"_{ext.lstrip('.').lower()}" if ext else ""
+    return os.path.join(folder, 'thumbs', f"{base}{suffix}_{width}.webp").replace('\\', '/')
+
+
+def make_thumbnails(field_file, force=False):
+    """Создает недостающие превью и отмечает их готовность. Возвращает количество созданных файлов."""
+    if not field_file: return 0
+    todo = [w for w in THUMB_WIDTHS if force or not default_storage.exists(thumb_name(field_file.name, w))]
+    created = render_thumbnails(field_file, todo) if todo else 0
+    mark_ready(field_file)
+    return created
+
+
+def render_thumbnails(field_file, widths):
+    with default_storage.open(field_file.name, 'rb') as f:
+        img = Image.open(f)
+        img = ImageOps.exif_transpose(img)
+        img.load()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+
+    created = 0
+    for width in widths:
+        thumb = img.copy()
+        if thumb.width > width:
+            thumb.thumbnail((width, width * thumb.height // thumb.width), Image.LANCZOS)
+        buf = BytesIO()
+        thumb.save(buf, 'WEBP', quality=THUMB_QUALITY, method=6)
+        name = thumb_name(field_file.name, width)
+        if default_storage.exists(name): default_storage.delete(name)
+        default_storage.save(name, ContentFile(buf.getvalue()))
+        created += 1
+    return created
+
+
+def mark_ready(field_file):
+    instance = field_file.instance
+    if instance.thumbs_for == field_file.name: return
+    instance.thumbs_for = field_file.name
+    type(instance).objects.filter(pk=instance.pk).update(thumbs_for=field_file.name)
+
+
+def thumbs_ready(field_file):
+    return bool(field_file) and field_file.instance.thumbs_for == field_file.name
+
+
+def delete_thumbnails(name):
+    if not name: return
+    for width in THUMB_WIDTHS:
+        thumb = thumb_name(name, width)
+        if default_storage.exists(thumb): default_storage.delete(thumb)
+
+
+def thumb_url(field_file, width):
+    """URL превью нужной ширины, пока превью не готовы — оригинал."""
+    if not field_file: return ""
+    if not thumbs_ready(field_file): return field_file.url
+    return default_storage.url(thumb_name(field_file.name, width))
+
+
+def thumb_srcset(field_file):
+    if not thumbs_ready(field_file): return ""
+    return ", ".join(f"{thumb_url(field_file, w)} {w}w" for w in THUMB_WIDTHS)
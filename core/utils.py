@@ -1,72 +1,165 @@
-from django.http import HttpResponse
+import csv
+import io
+import tempfile
+from itertools import chain, islice
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser
+from django.http import FileResponse, HttpRequest, QueryDict
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
-from .models import Order, WithdrawalRequest
+from .models import Order, ArchivedOrder, WithdrawalRequest, ExportJob
 
-def export_to_excel(modeladmin, request, queryset):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Export Data"
-    if queryset.model == Order:
-        headers = [
-            'ID', 'Пользователь', 'Артикул', 'Товар', 'Цена WB', '% Кэшбэка', 
-            'Статус', 'Дата', 'Реквизиты', 'Скрин Заказа', 'Скрин Чека', 'Номер чека'
-        ]
-    elif queryset.model == WithdrawalRequest:
-        headers = ['ID', 'Пользователь', 'Сумма', 'Реквизиты', 'Статус', 'Дата']
-    else:
-        headers = [field.name for field in modeladmin.model._meta.fields]
-
-    ws.append(headers)
+# --- УМНЫЙ ЭКСПОРТ В EXCEL ---
+# Строки читаются из БД пачками (iterator), книга пишется в режиме write_only во
+# временный файл, а ответ отдается потоком — память не растет с размером выгрузки.
+CHUNK_SIZE = 2000
+WIDTH_SAMPLE = 200
+MAX_WIDTH = 60
+
+ORDER_HEADERS = [
+    'ID', 'Пользователь', 'Артикул', 'Товар', 'Цена WB', '% Кэшбэка', 
+    'Статус', 'Дата', 'Реквизиты', 'Скрин Заказа', 'Скрин Чека', 'Номер чека'
+]
+WITHDRAWAL_HEADERS = ['ID', 'Пользователь', 'Сумма', 'Реквизиты', 'Статус', 'Дата']
+
+
+def order_row(obj):
+    u_name = str(obj.user) if obj.user else "Нет"
+    details = obj.user.payment_details if obj.user and obj.user.payment_details else "Нет реквизитов"
     
-    for cell in ws[1]: 
+    p_art = obj.product.article if obj.product else "-"
+    p_name = obj.product.name if obj.product else "-"
+    p_price = obj.product.wb_price if obj.product else 0
+    p_perc = obj.product.cashback_percent if obj.product else 0
+    
+    s1 = obj.screenshot.url if obj.screenshot else "-"
+    s2 = obj.receipt_screenshot.url if obj.receipt_screenshot else "-"
+    check_num = obj.check_number if obj.check_number else "-"
+    
+    date_str = obj.created_at.strftime("%d.%m.%Y %H:%M")
+    
+    return [
+        obj.id, u_name, p_art, p_name, p_price, f"{p_perc}%", 
+        obj.get_status_display(), date_str, details, s1, s2, check_num
+    ]
+
+
+def withdrawal_row(obj):
+    return [
+        obj.id, str(obj.user), obj.amount, obj.phone_number, 
+        obj.get_status_display(), obj.created_at.strftime("%d.%m.%Y %H:%M")
+    ]
+
+
+def export_rows(queryset):
+    """Заголовки и генератор строк для выгрузки любой модели из админки."""
+    model = queryset.model
+    if model in (Order, ArchivedOrder):
+        qs = queryset.select_related('user', 'product')
+        return ORDER_HEADERS, (order_row(obj) for obj in qs.iterator(chunk_size=CHUNK_SIZE))
+    if model == WithdrawalRequest:
+        qs = queryset.select_related('user')
+        return WITHDRAWAL_HEADERS, (withdrawal_row(obj) for obj in qs.iterator(chunk_size=CHUNK_SIZE))
+    headers = [field.name for field in model._meta.fields]
+    return headers, ([str(getattr(obj, field, "-")) for field in headers] for obj in queryset.iterator(chunk_size=CHUNK_SIZE))
+
+
+def write_xlsx(headers, rows, fileobj, title="Export Data"):
+    """Пишет книгу в fileobj. Ширина колонок оценивается по первым WIDTH_SAMPLE строкам."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+
+    rows = iter(rows)
+    sample = list(islice(rows, WIDTH_SAMPLE))
+    for idx, header in enumerate(headers, 1):
+        length = max([len(str(header))] + [len(str(r[idx - 1])) for r in sample if len(r) >= idx])
+        ws.column_dimensions[get_column_letter(idx)].width = min(length + 2, MAX_WIDTH)
+
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
         cell.font = Font(bold=True)
+        header_cells.append(cell)
+    ws.append(header_cells)
 
-    for obj in queryset:
-        row = []
-        
-        if queryset.model == Order:
-            u_name = str(obj.user) if obj.user else "Нет"
-            details = obj.user.payment_details if obj.user and obj.user.payment_details else "Нет реквизитов"
-            
-            p_art = obj.product.article if obj.product else "-"
-            p_name = obj.product.name if obj.product else "-"
-            p_price = obj.product.wb_price if obj.product else 0
-            p_perc = obj.product.cashback_percent if obj.product else 0
-            
-            s1 = obj.screenshot.url if obj.screenshot else "-"
-            s2 = obj.receipt_screenshot.url if obj.receipt_screenshot else "-"
-            check_num = obj.check_number if obj.check_number else "-"
-            
-            date_str = obj.created_at.strftime("%d.%m.%Y %H:%M")
-            
-            row = [
-                obj.id, u_name, p_art, p_name, p_price, f"{p_perc}%", 
-                obj.get_status_display(), date_str, details, s1, s2, check_num
-            ]
-        
-        elif queryset.model == WithdrawalRequest:
-            row = [
-                obj.id, str(obj.user), obj.amount, obj.phone_number, 
-                obj.get_status_display(), obj.created_at.strftime("%d.%m.%Y %H:%M")
-            ]
-        
-        else:
-            for field in headers:
-                val = getattr(obj, field, "-")
-                row.append(str(val))
-        
+    count = 0
+    for row in chain(sample, rows):
         ws.append(row)
+        count += 1
+    wb.save(fileobj)
+    return count
 
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value) or "") for cell in column_cells)
-        ws.column_dimensions[get_column_letter(column_cells[0].column)].width = length + 2
 
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename={queryset.model._meta.model_name}_report.xlsx'
-    wb.save(response)
-    return response
+def write_csv(headers, rows, fileobj):
+    # utf-8-sig + ";" — чтобы Excel открывал кириллицу и колонки без мастера импорта
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text, delimiter=';')
+    writer.writerow(headers)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+def export_to_excel(modeladmin, request, queryset):
+    headers, rows = export_rows(queryset)
+    tmp = tempfile.TemporaryFile()
+    write_xlsx(headers, rows, tmp)
+    tmp.seek(0)
+    return FileResponse(
+        tmp,
+        as_attachment=True,
+        filename=f'{queryset.model._meta.model_name}_report.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
 
 # Настраиваем название действия здесь же
 export_to_excel.short_description = "Скачать Excel отчет (.xlsx)"
+
+
+def export_selection(request, queryset):
+    """Что выбрано в админке, в виде JSON: отмеченные id или строка фильтров списка ("выбрать все")."""
+    if request.POST.get('select_across') == '1':
+        return {'changelist': request.GET.urlencode()}
+    return {'pks': list(queryset.values_list('pk', flat=True))}
+
+
+def selection_queryset(job):
+    """Пересобирает queryset задачи выгрузки тем же ModelAdmin, что показывал список."""
+    model = apps.get_model(job.model)
+    if 'pks' in job.selection:
+        return model._default_manager.filter(pk__in=job.selection['pks'])
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(job.selection.get('changelist', ''))
+    request.user = job.created_by or AnonymousUser()
+    modeladmin = admin.site.get_model_admin(model)
+    return modeladmin.get_changelist_instance(request).get_queryset(request)
+
+
+def queue_export(modeladmin, request, queryset, fmt):
+    job = ExportJob.objects.create(
+        model=queryset.model._meta.label,
+        selection=export_selection(request, queryset),
+        format=fmt,
+        created_by=request.user if request.user.is_authenticated else None,
+    )
+    modeladmin.message_user(request, f"Выгрузка #{job.id} поставлена в очередь. Файл появится в разделе «Выгрузки».")
+
+
+def export_to_excel_background(modeladmin, request, queryset):
+    queue_export(modeladmin, request, queryset, 'xlsx')
+
+export_to_excel_background.short_description = "Выгрузить в фоне (.xlsx)"
+
+
+def export_to_csv_background(modeladmin, request, queryset):
+    queue_export(modeladmin, request, queryset, 'csv')
+
+export_to_csv_background.short_description = "Выгрузить в фоне (.csv)"
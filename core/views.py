@@ -1,37 +1,50 @@
 import json
-import requests
-import os
+import hashlib
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.csrf import csrf_exempt
-from .models import Product, TelegramUser, Order, CartItem
+from .models import Product, TelegramUser, Order, ArchivedOrder, CartItem
+from .cache import get_catalog_cards, get_catalog_version
+from .thumbnails import thumb_url, thumb_srcset
+from .outbox import queue_message
+from .order_state import invalidate_order_states
+from .search import fts_filter, PRODUCT_FTS
+from . import metrics
 
-BOT_TOKEN = os.getenv('BOT_TOKEN')
+CATALOG_PAGE_SIZE = 20
+CATALOG_PAGE_MAX = 100
 
 def webapp_catalog(request):
     user_id = request.GET.get('user_id')
     user = None
     orders = []
-    bought_ids = []
+    bought_ids = set()
 
     if user_id:
         try:
             user = TelegramUser.objects.get(telegram_id=user_id)
-            orders = Order.objects.select_related('product').filter(user=user).order_by('-created_at')
-            bought_ids = list(orders.values_list('product_id', flat=True))
+            # История = рабочие заказы + перенесенные в холодный архив (они всегда старше)
+            orders = list(Order.objects.select_related('product').filter(user=user).order_by('-created_at'))
+            orders += ArchivedOrder.objects.select_related('product').filter(user=user).order_by('-created_at')
+            bought_ids = {o.product_id for o in orders}
         except TelegramUser.DoesNotExist: pass
 
-    products = Product.objects.filter(active=True).prefetch_related('images')
+    # Сетка товаров берется из кэша, на запрос считаются только данные юзера
+    cards = [bought if pid in bought_ids else card for pid, card, bought in get_catalog_cards()]
     
     return render(request, 'core/catalog.html', {
-        'products': products,
+        'cards': cards,
         'user': user,
         'orders': orders,
         'bought_ids': bought_ids
     })
 
 @csrf_exempt
-def create_order_api(request):
+async def create_order_api(request):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
 
@@ -49,88 +62,176 @@ def create_order_api(request):
     if not product_ids_str:
         return JsonResponse({'success': False, 'error': 'No products selected'}, status=400)
 
-    user = TelegramUser.objects.filter(telegram_id=user_id).first()
-    if not user:
-        return JsonResponse({'success': False, 'error': 'User not found'}, status=404)
-
     p_ids = [pid for pid in product_ids_str.split(',') if pid]
-    
-    products = Product.objects.filter(id__in=p_ids)
-    
-    created_orders = []
-    product_names = []
-
-    for product in products:
-        order, created = Order.objects.get_or_create(
-            user=user, 
-            product=product, 
-            defaults={'status': 'ordered'}
+    result, status = await sync_to_async(_create_orders)(user_id, p_ids)
+    return JsonResponse(result, status=status)
+
+def _create_orders(user_id, p_ids):
+    # Все в одной транзакции и постоянным числом запросов, независимо от размера корзины.
+    # Транзакции в async ORM недоступны, поэтому этот блок вызывается через sync_to_async.
+    # Строка юзера блокируется, чтобы двойной клик не создал заказы дважды;
+    # уникальный индекс (user, product) страхует на уровне БД.
+    with transaction.atomic():
+        user = TelegramUser.objects.select_for_update().filter(telegram_id=user_id).first()
+        if not user:
+            return {'success': False, 'error': 'User not found'}, 404
+
+        products = list(Product.objects.filter(id__in=p_ids).only('id', 'name'))
+        existing = set(Order.objects.filter(user=user, product__in=products).values_list('product_id', flat=True))
+        existing |= set(ArchivedOrder.objects.filter(user=user, product__in=products).values_list('product_id', flat=True))
+        new_products = [p for p in products if p.id not in existing]
+
+        if not new_products:
+            queue_message(user_id, "⚠️ Эти товары уже были заказаны.")
+            return {'success': True, 'message': 'Дубликаты'}, 200
+
+        Order.objects.bulk_create(
+            [Order(user=user, product=p, status='ordered') for p in new_products],
+            ignore_conflicts=True,
         )
-        if created:
-            created_orders.append(order)
-            product_names.append(product.name)
-
-    if not created_orders:
-        send_telegram_message(user_id, "⚠️ Эти товары уже были заказаны.")
-        return JsonResponse({'success': True, 'message': 'Дубликаты'})
-
-    CartItem.objects.filter(user=user).delete()
-    
-    msg_text = f"✅ <b>Заказ принят!</b> ({len(created_orders)} шт.)\n\n" + "\n".join([f"• {n}" for n in product_names]) + "\n\nЖдите проверки!"
-    send_telegram_message(user_id, msg_text)
+        CartItem.objects.filter(user=user).delete()
+        transaction.on_commit(lambda: invalidate_order_states([user_id]))
+        
+        msg_text = f"✅ <b>Заказ принят!</b> ({len(new_products)} шт.)\n\n" + "\n".join([f"• {p.name}" for p in new_products]) + "\n\nЖдите проверки!"
+        queue_message(user_id, msg_text)
     
-    return JsonResponse({'success': True, 'message': 'Заказ создан'})
+    return {'success': True, 'message': 'Заказ создан'}, 200
 
-def get_cart_api(request):
+async def get_cart_api(request):
     user_id = request.GET.get('user_id')
     if not user_id: return JsonResponse({'cart': []})
     try:
-        user = TelegramUser.objects.get(telegram_id=user_id)
-        cart_items = user.cart_items.select_related('product').all()
+        user = await TelegramUser.objects.aget(telegram_id=user_id)
         cart_data = []
-        for item in cart_items:
+        async for item in user.cart_items.select_related('product').all():
             p = item.product
             cart_data.append({
                 'id': str(p.id),
                 'name': p.name,
                 'price': str(p.price),
-                'img': p.image.url if p.image else ""
+                'img': thumb_url(p.image, 320)
             })
         return JsonResponse({'cart': cart_data, 'payment_details': user.payment_details or "" })
     except: return JsonResponse({'cart': []})
 
+def product_json(p):
+    return {
+        'id': str(p.id),
+        'name': p.name,
+        'article': p.article,
+        'price': str(p.price),
+        'wb_price': str(p.wb_price),
+        'cashback': p.calculated_cashback,
+        'description': p.description,
+        'img': thumb_url(p.image, 320),
+        'srcset': thumb_srcset(p.image),
+        'images': [thumb_url(i.image, 640) for i in p.images.all()],
+    }
+
+def catalog_api(request):
+    # Постраничная выдача каталога: ?after=<id последнего товара>&limit=N
+    try:
+        after = int(request.GET.get('after') or 0)
+        limit = min(max(int(request.GET.get('limit') or CATALOG_PAGE_SIZE), 1), CATALOG_PAGE_MAX)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    # ETag зависит только от версии каталога и курсора, поэтому 304 отдаем без запросов в БД.
+    # If-None-Match разбирает Django по RFC 9110: слабые W/"..." и * тоже совпадают
+    raw = f"{get_catalog_version()}:{after}:{limit}"
+    etag = '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        return response
+
+    products = list(
+        Product.objects.filter(active=True, id__gt=after)
+        .order_by('id')
+        .prefetch_related('images')[:limit + 1]
+    )
+    has_more = len(products) > limit
+    products = products[:limit]
+
+    response = JsonResponse({
+        'products': [product_json(p) for p in products],
+        'next': str(products[-1].id) if has_more else None,
+    })
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def catalog_search_api(request):
+    # Поиск по каталогу для WebApp: ?q=<название, артикул или слово из описания>
+    q = request.GET.get('q', '').strip()[:100]
+    if not q: return JsonResponse({'products': []})
+    products = Product.objects.filter(active=True)
+    found = fts_filter(products, PRODUCT_FTS, q)
+    if found is None:
+        found = products.filter(Q(name__icontains=q) | Q(article__icontains=q))
+    found = found.order_by('id').prefetch_related('images')[:CATALOG_PAGE_SIZE]
+    return JsonResponse({'products': [product_json(p) for p in found]})
+
 @csrf_exempt
-def update_cart_api(request):
+async def update_cart_api(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         user_id = data.get('user_id')
         product_id = data.get('product_id')
         action = data.get('action')
         if not user_id or not product_id: return JsonResponse({'ok': False})
-        user, _ = TelegramUser.objects.get_or_create(telegram_id=user_id)
-        product = Product.objects.get(id=product_id)
-        if action == 'add': CartItem.objects.get_or_create(user=user, product=product)
-        elif action == 'remove': CartItem.objects.filter(user=user, product=product).delete()
+        user, _ = await TelegramUser.objects.aget_or_create(telegram_id=user_id)
+        product = await Product.objects.aget(id=product_id)
+        if action == 'add': await CartItem.objects.abulk_create([CartItem(user=user, product=product)], ignore_conflicts=True)
+        elif action == 'remove': await CartItem.objects.filter(user=user, product=product).adelete()
         return JsonResponse({'ok': True})
     return JsonResponse({'ok': False})
 
 @csrf_exempt
-def save_payment_details_api(request):
+def update_cart_batch_api(request):
+    # Пачка изменений корзины: {"user_id": ..., "ops": [{"product_id": ..., "action": "add"|"remove"}, ...]}
+    if request.method != 'POST': return JsonResponse({'ok': False}, status=405)
+    try:
+        data = json.loads(request.body)
+        user_id = int(data.get('user_id'))
+        # Для каждого товара важно только последнее действие
+        final = {}
+        for op in data.get('ops') or []:
+            if op.get('action') in ('add', 'remove'):
+                final[int(op.get('product_id'))] = op['action']
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'ok': False}, status=400)
+    if not final: return JsonResponse({'ok': True})
+
+    add_ids = [pid for pid, action in final.items() if action == 'add']
+    remove_ids = [pid for pid, action in final.items() if action == 'remove']
+
+    with transaction.atomic():
+        user, _ = TelegramUser.objects.get_or_create(telegram_id=user_id)
+        if add_ids:
+            add_ids = Product.objects.filter(id__in=add_ids).values_list('id', flat=True)
+            CartItem.objects.bulk_create(
+                [CartItem(user=user, product_id=pid) for pid in add_ids],
+                ignore_conflicts=True,
+            )
+        if remove_ids:
+            CartItem.objects.filter(user=user, product_id__in=remove_ids).delete()
+    return JsonResponse({'ok': True})
+
+@csrf_exempt
+async def save_payment_details_api(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         user_id = data.get('user_id')
         details = data.get('details')
         try:
-            user = TelegramUser.objects.get(telegram_id=user_id)
-            user.payment_details = details
-            user.save()
-            return JsonResponse({'ok': True})
+            updated = await TelegramUser.objects.filter(telegram_id=user_id).aupdate(payment_details=details)
+            if updated: return JsonResponse({'ok': True})
         except: pass
     return JsonResponse({'ok': False})
 
-def send_telegram_message(chat_id, text):
-    if not BOT_TOKEN: return
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}
-    try: requests.post(url, json=payload, timeout=2)
-    except: pass
+def metrics_view(request):
+    # Prometheus text format; нужен заголовок Authorization: Bearer <METRICS_TOKEN>
+    if not metrics.is_authorized(request.headers.get('Authorization')):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
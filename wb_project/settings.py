@@ -1,4 +1,5 @@
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -24,6 +25,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,12 +54,16 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'wb_project.wsgi.application'
+ASGI_APPLICATION = 'wb_project.asgi.application'
 
 # Database
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Бот пишет в БД из нескольких потоков (core/db_executor.py): IMMEDIATE берет блокировку
+        # на запись в начале транзакции, и конкурент ждет timeout, а не падает с "database is locked"
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
 
@@ -93,3 +99,19 @@ X_FRAME_OPTIONS = 'ALLOWALL'
 
 # Разрешаем Ngrok (чтобы не было ошибок безопасности)
 CSRF_TRUSTED_ORIGINS = ['https://*.ngrok-free.dev', 'https://*.ngrok-free.app']
+
+# Общий кэш для всех воркеров (каталог WebApp и т.п.)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
+# Метрики (/metrics) и лог медленных SQL (0 — выключен)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC') == '1'  # без токена и без этого флага /metrics закрыт
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 0))
+
+# Порог похожести скринов в битах dHash (manage.py hash_screenshots --calibrate покажет распределение)
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 8))
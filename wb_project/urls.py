@@ -6,8 +6,12 @@ from core.views import (
     webapp_catalog, 
     create_order_api, 
     get_cart_api, 
+    catalog_api,
+    catalog_search_api,
     update_cart_api, 
-    save_payment_details_api
+    update_cart_batch_api,
+    save_payment_details_api,
+    metrics_view
 )
 
 urlpatterns = [
@@ -17,8 +21,13 @@ urlpatterns = [
     # API endpoints
     path('api/create-order/', create_order_api, name='create_order'),
     path('api/get-cart/', get_cart_api, name='get_cart'),
+    path('api/catalog/', catalog_api, name='catalog'),
+    path('api/catalog/search/', catalog_search_api, name='catalog_search'),
     path('api/update-cart/', update_cart_api, name='update_cart'),
+    path('api/update-cart-batch/', update_cart_batch_api, name='update_cart_batch'),
     path('api/save-details/', save_payment_details_api, name='save_details'),
+
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG: